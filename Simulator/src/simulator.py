@@ -1,31 +1,98 @@
 import timetable as tt
 import dash
-import pandas as pd
+import numpy as np
 # from dash import Dash, html, dcc, Input, Output, State, callback_context
 # import dash_bootstrap_components as dbc
 import io
-import base64
-import plotly.graph_objs as go
-import copy
+import binascii
+import json
+import hashlib
 from datetime import datetime
-from dataclasses import dataclass, field
-from typing import List, Optional, Tuple
+from dataclasses import dataclass, field, replace
+from typing import FrozenSet, List, Optional, Tuple
 from timetable import Direction
-import time
 import utils
-from dash import dash_table
 from dash.exceptions import PreventUpdate
 from timetable import Line
 
 from ui import *
+from ui import _TIME_STR_ARR # the one minute -> "HH:MM" table, "--:--" last
 from enum import Enum
-
-def fmt_time(t):
-    """Format time in minutes to HH:MM string"""
-    if t is None:
-        return "--:--"
-    t = int(round(t))
-    return f"{t//60:02d}:{t%60:02d}"
+from itertools import chain
+from collections import OrderedDict
+from heapq import nlargest, nsmallest
+from operator import attrgetter
+import logging
+
+logger = logging.getLogger(__name__)
+
+# filter component id -> FilterQuery field it drives
+_QUERY_INPUTS = {
+    'start-station': 'startStation',
+    'start-station_service': 'startStation',
+    'end-station': 'endStation',
+    'end-station_service': 'endStation',
+    'intermediate-stations': 'passingThrough',
+    'intermediate-stations_service': 'passingThrough',
+    'time-range-slider': 'inTimePeriod',
+    'time-range-slider_service': 'inTimePeriod',
+    'time-range-slider_station': 'inTimePeriod',
+    'ac-selector': 'ac',
+    'direction-selector': 'inDirection',
+}
+_QUERY_INPUT_POS = {cid: i for i, cid in enumerate(_QUERY_INPUTS)}
+
+# trace colours of AC rakes/services (bright, and dimmed context traces)
+_AC_COLOR = "rgba(66,133,244,0.8)"
+_AC_COLOR_DIM = "rgba(66,133,244,0.6)"
+_NONAC_COLOR = "rgba(90,90,90,0.8)"
+_NONAC_COLOR_DIM = "rgba(90,90,90,0.6)"
+
+# base figures kept in Simulator._figCache; each holds every trace point
+_FIG_CACHE_SIZE = 16
+# table rows kept in Simulator._rowCache: a rake and a service entry per query
+_ROW_CACHE_SIZE = 2 * _FIG_CACHE_SIZE
+# Query Info blocks kept in Simulator._panelCache, one per selected link/service
+_PANEL_CACHE_SIZE = 256
+
+def _lru_get(cache, key):
+    '''cache[key] (None on a miss), marked most recently used.'''
+    value = cache.get(key)
+    if value is not None:
+        cache.move_to_end(key)
+    return value
+
+def _lru_put(cache, key, value, size):
+    '''Store value under key, dropping the least recently used beyond size.'''
+    cache[key] = value
+    if len(cache) > size:
+        cache.popitem(last=False)
+    return value
+
+# base64 chars decoded per step in Simulator._decode_upload (multiple of 4)
+_B64_CHUNK = 1 << 20
+
+def _clock_array(times):
+    '''Clock label of each time in minutes (floored, hour mod 24),
+    "--:--" for NaN; looked up in ui's _TIME_STR_ARR.'''
+    t = np.asarray(times, dtype=float)
+    missing = np.isnan(t)
+    idx = np.floor(np.where(missing, 0, t)).astype(np.int64) % 1440
+    idx[missing] = len(_TIME_STR_ARR) - 1
+    return _TIME_STR_ARR[idx]
+
+def _clock_labels(times):
+    '''_clock_array as a list.'''
+    return _clock_array(times).tolist()
+
+def _hover_data(stations, times):
+    '''customdata rows (station, "HH:MM") read by the trace hovertemplates;
+    the per-trace prefix lives once in the template, not in every point.'''
+    return np.column_stack((np.asarray(stations, dtype=object), _clock_array(times)))
+
+def _link_length_text(rc):
+    '''"A (123.4 km)" entry of the summary card's shortest/longest lists.'''
+    return f"{rc.linkName} ({rc.lengthKm:.1f} km)"
 
 class FilterType(Enum):
     RAKELINK = 'rakelink'
@@ -33,20 +100,34 @@ class FilterType(Enum):
     STATION = 'station'
 
 
-@dataclass
+@dataclass(frozen=True, slots=True)
 class FilterQuery:
+    '''Immutable + hashable; swap fields with Simulator._update_query.'''
     type: Optional[FilterType] = None
     
     # Make fields mode-specific (no properties needed)
     startStation: Optional[str] = None
     endStation: Optional[str] = None
-    passingThrough: List[str] = field(default_factory=list)
+    passingThrough: Tuple[str, ...] = ()
     inTimePeriod: Optional[Tuple[int, int]] = (165, 1605)
     
     ac: Optional[bool] = None
-    inDirection: Optional[List[str]] = None
-    selectedLinks: List[str] = field(default_factory=list)
-    selectedServices: List[str] = field(default_factory=list)
+    inDirection: Optional[Tuple[str, ...]] = None
+    selectedLinks: Tuple[str, ...] = ()
+    selectedServices: Tuple[str, ...] = ()
+
+    # upper-cased passingThrough for O(1) membership tests; derived, so
+    # it is kept out of __init__, equality and hashing
+    passingThroughSet: FrozenSet[str] = field(init=False, repr=False, compare=False)
+    # selections as sets for the per-trace highlight checks
+    selectedLinkSet: FrozenSet[str] = field(init=False, repr=False, compare=False)
+    selectedServiceSet: FrozenSet[str] = field(init=False, repr=False, compare=False)
+
+    def __post_init__(self):
+        object.__setattr__(self, 'passingThroughSet',
+                           frozenset(s.upper() for s in self.passingThrough or ()))
+        object.__setattr__(self, 'selectedLinkSet', frozenset(self.selectedLinks))
+        object.__setattr__(self, 'selectedServiceSet', frozenset(self.selectedServices))
 
 
 class Simulator:
@@ -60,18 +141,201 @@ class Simulator:
 
         self._ui = SimulatorUI()
         # set initial layout
-        self.app.layout = self._ui.drawLayout()
+        self.app.layout = self._ui.layout
         self.initCallbacks()
         self.linkTimingsCreated = False
 
-        self.query = FilterQuery()
-        self.query.type = FilterType.RAKELINK
+        self.query = FilterQuery(type=FilterType.RAKELINK)
 
+        # last query seen on each tab; FilterQuery is frozen, so storing
+        # the instance itself is a free snapshot
         self.filterStates = {
-            FilterType.RAKELINK: {},
-            FilterType.SERVICE: {},
-            FilterType.STATION: {}
+            FilterType.RAKELINK: FilterQuery(),
+            FilterType.SERVICE: FilterQuery(),
+            FilterType.STATION: FilterQuery()
+        }
+
+        # lookup indices for the query info panel, see _on_wtt_loaded
+        self._rcByLink = {}
+        self._svcBySid = {}
+        # (linkName, serviceId str or None) per trace of the last built figure
+        self._traceKeys = []
+        # base figures (before highlighting) keyed by (upload digests,
+        # _query_key), least recently used first; see _FIG_CACHE_SIZE
+        self._figCache = OrderedDict()
+        # (rows, key -> row index) keyed by (table, _query_key), least
+        # recently used first; see _ROW_CACHE_SIZE. Cleared with _figCache
+        self._rowCache = OrderedDict()
+        # Query Info blocks keyed by (kind, key, AC state), least recently
+        # used first; see _PANEL_CACHE_SIZE. Cleared with _rowCache
+        self._panelCache = OrderedDict()
+        # key -> row index of the rows currently shown in each table, and
+        # the key column itself (row order) for selected_rows lookups
+        self._rakeRowIndex = {}
+        self._svcRowIndex = {}
+        self._rakeRowNames = ()
+        self._svcRowNames = ()
+        # (upload digests, _query_key) the tables were last sent for; None
+        # when their rows may differ from a rebuild (new WTT, AC conversion)
+        self._tablesKey = None
+        # (stations tuple, dropdown options) of the last registered WTT
+        self._stationOptions = ((), [])
+        # blake2b digests of the WTT/summary uploads the parser was built from
+        self._wttDigest = None
+        self._backendDigests = None
+
+    def _on_wtt_loaded(self):
+        '''Rebuild the linkName/serviceId indices. Call whenever the
+        parsed rakecycles or suburban services change.'''
+        wtt = self.parser.wtt
+        self._rcByLink = wtt.rakecyclesByLink
+        self._svcBySid = {
+            str(sid): svc
+            for svc in wtt.suburbanServices
+            for sid in svc.serviceId
         }
+        self._figCache.clear()
+        self._rowCache.clear()
+        self._panelCache.clear()
+        self._tablesKey = None
+
+    def _update_query(self, **changes):
+        '''Replace self.query with a copy that has the given fields changed.
+        Lists coming from Dash components are stored as tuples.'''
+        for name, value in changes.items():
+            if isinstance(value, list):
+                changes[name] = tuple(value)
+        if all(getattr(self.query, k) == v for k, v in changes.items()):
+            return
+        self.query = replace(self.query, **changes)
+
+    def _query_key(self, qq):
+        '''Hashable key of the filter fields that shape the figure.
+        Selections only affect highlighting, so they are left out.'''
+        return replace(qq, selectedLinks=(), selectedServices=())
+
+    def _build_base_figure(self, qq):
+        '''Return the unhighlighted figure for qq, building it only on a cache miss.
+        Render flags must already be set by _apply_filters.'''
+        key = (self._backendDigests, self._query_key(qq))
+        cached = self._figCache.get(key)
+        if cached is not None:
+            self._figCache.move_to_end(key)
+            fig, self._traceKeys, _ = cached
+            return fig
+
+        fig = self.visualizeLinks3D()
+        # [figure, trace keys, serialized payload (filled by _figure_payload)]
+        self._figCache[key] = [fig, self._traceKeys, None]
+        if len(self._figCache) > _FIG_CACHE_SIZE:
+            self._figCache.popitem(last=False)
+        return fig
+
+    def _figure_payload(self, qq, fig):
+        '''Plain-dict form of the cached figure for qq, converted once per cache entry.
+        Dash then serializes the dict directly instead of re-walking the go.Figure.'''
+        cached = self._figCache.get((self._backendDigests, self._query_key(qq)))
+        if cached is None or cached[0] is not fig:
+            return fig
+        if cached[2] is None:
+            cached[2] = fig.to_plotly_json()
+        return cached[2]
+
+    def _ac_color_patch(self, link_names):
+        '''Patch the traces of newly converted links to the AC colour.'''
+        patch = dash.Patch()
+        for i, (link, sid) in enumerate(self._traceKeys):
+            if link not in link_names:
+                continue
+            # service-mode context traces (no sid) use the dimmed colour
+            color = _AC_COLOR_DIM if (sid is None and self.query.type == FilterType.SERVICE) else _AC_COLOR
+            patch["data"][i]["line"]["color"] = color
+            patch["data"][i]["marker"]["color"] = color
+        return patch
+
+    def _rake_table_rows(self, qq):
+        '''(rows, {linkName: row index}) of rake-link-table for the rendered
+        rakecycles, cached per query.'''
+        key = ("rake", self._query_key(qq))
+        cached = _lru_get(self._rowCache, key)
+        if cached is not None:
+            return cached
+
+        rows = []
+        for rc in self.parser.wtt.rakecycles:
+            if not rc.render or rc.rake is None:
+                continue
+
+            rows.append({
+                "id": rc.linkName,
+                "linkname": rc.linkName,
+                "cars": rc.rake.rakeSize,
+                "is_ac": "AC" if rc.rake.isAC else "Non-AC",
+                "length_km": int(rc.lengthKm),
+                "start": rc.servicePath[0].initStation.name,
+                "end": rc.servicePath[-1].finalStation.name,
+                "n_services": len(rc.servicePath),
+            })
+        index = {row["linkname"]: i for i, row in enumerate(rows)}
+        return _lru_put(self._rowCache, key, (rows, index), _ROW_CACHE_SIZE)
+
+    def _service_table_rows(self, qq):
+        '''(rows, {serviceId: row index}) of service-table for the rendered
+        services, cached per query.'''
+        key = ("service", self._query_key(qq))
+        cached = _lru_get(self._rowCache, key)
+        if cached is not None:
+            return cached
+
+        rows = []
+        index = {}
+        kept = [svc for svc in self.parser.wtt.suburbanServices if svc.render and svc.events]
+        # start times formatted in one batch
+        starts = fmt_times(np.fromiter(
+            (np.nan if svc.firstEventTime is None else svc.firstEventTime for svc in kept),
+            dtype=float, count=len(kept)))
+        for svc, start_time in zip(kept, starts):
+            svc_id_str = svc.serviceIdStr
+            for sid in svc.serviceId:
+                index.setdefault(str(sid), len(rows))
+            rows.append({
+                "id": svc_id_str,  # Used for selection tracking
+                "service_id": svc_id_str,
+                "direction": svc.direction.name if svc.direction else "?",
+                "is_ac": "AC" if svc.needsACRake else "Non-AC",
+                "cars": svc.rakeSizeReq if svc.rakeSizeReq else "?",
+                "start_station": svc.initStation.name if svc.initStation else "?",
+                "end_station": svc.finalStation.name if svc.finalStation else "?",
+                "start_time": start_time,
+                "rake_link": svc.rakeLinkName or "?",
+            })
+        return _lru_put(self._rowCache, key, (rows, index), _ROW_CACHE_SIZE)
+
+    def _clicked_trace_key(self, clickData):
+        '''(linkName, serviceId str or None) of the clicked trace, read
+        from _traceKeys by curveNumber; None if it can't be resolved.'''
+        points = clickData.get("points") if clickData else None
+        if not points:
+            return None
+        idx = points[0].get("curveNumber")
+        if idx is None or not 0 <= idx < len(self._traceKeys):
+            return None
+        return self._traceKeys[idx]
+
+    def _selected_names(self, names, selected_rows):
+        '''Key column values of the selected table rows, in selection order.'''
+        if not selected_rows:
+            return []
+        n = len(names)
+        return [names[idx] for idx in selected_rows if idx < n]
+
+    def _panel_block(self, key, build, obj):
+        '''build(obj), reused while key (which carries the AC state) is
+        unchanged, so toggling one selection rebuilds only its own block.'''
+        block = _lru_get(self._panelCache, key)
+        if block is None:
+            block = _lru_put(self._panelCache, key, build(obj), _PANEL_CACHE_SIZE)
+        return block
 
     def build_query_info_panel(self):
         if self.query.type == FilterType.RAKELINK:
@@ -85,35 +349,37 @@ class Simulator:
         if not self.query.selectedServices:
             return html.Div("No services selected.")
         
-        # Find selected service objects
-        selected_svcs = [
-            svc for svc in self.parser.wtt.suburbanServices
-            if any(str(sid) in self.query.selectedServices for sid in svc.serviceId)
-        ]
+        # Find selected service objects. Table rows carry the joined
+        # id string ("93001,93002"), the index is keyed by single ids.
+        selected_svcs = []
+        for sel in self.query.selectedServices:
+            svc = self._svcBySid.get(sel.split(',')[0])
+            if svc is not None:
+                selected_svcs.append(svc)
         
-        return html.Div(
-            [
-                html.Div(
-                    "Selected Services",
-                    style={
-                        "fontSize": "13px",
-                        "fontWeight": "600",
-                        "color": "#475569",
-                        "marginBottom": "6px"
-                    }
-                ),
-                *[self.build_service_detail_block(svc) for svc in selected_svcs]
-            ],
-            style={"padding": "8px"}
+        children = [
+            html.Div(
+                "Selected Services",
+                style={
+                    "fontSize": "13px",
+                    "fontWeight": "600",
+                    "color": "#475569",
+                    "marginBottom": "6px"
+                }
+            )
+        ]
+        children.extend(
+            self._panel_block(("service", svc.serviceIdStr, svc.needsACRake),
+                              self.build_service_detail_block, svc)
+            for svc in selected_svcs
         )
+        return html.Div(children, style={"padding": "8px"})
 
     def build_service_detail_block(self, svc):
-        svc_id_str = ','.join(str(sid) for sid in svc.serviceId)
-        
         return html.Div(
             [
                 html.Div(
-                    f"Service {svc_id_str}",
+                    f"Service {svc.serviceIdStr}",
                     style={"fontWeight": "600", "marginBottom": "4px"}
                 ),
                 html.Div(
@@ -133,25 +399,27 @@ class Simulator:
             return html.Div("No rake links selected.")
 
         selected_rcs = [
-            rc for rc in self.parser.wtt.rakecycles
-            if rc.linkName in self.query.selectedLinks
+            self._rcByLink[name] for name in self.query.selectedLinks
+            if name in self._rcByLink
         ]
 
-        return html.Div(
-            [
-                html.Div(
-                    "Selected Rake Links",
-                    style={
-                        "fontSize": "13px",
-                        "fontWeight": "600",
-                        "color": "#475569",
-                        "marginBottom": "6px"
-                    }
-                ),
-                *[self.build_rake_path_block(rc) for rc in selected_rcs]
-            ],
-            style={"padding": "8px"}
+        children = [
+            html.Div(
+                "Selected Rake Links",
+                style={
+                    "fontSize": "13px",
+                    "fontWeight": "600",
+                    "color": "#475569",
+                    "marginBottom": "6px"
+                }
+            )
+        ]
+        children.extend(
+            self._panel_block(("rake", rc.linkName, rc.acServiceCount),
+                              self.build_rake_path_block, rc)
+            for rc in selected_rcs
         )
+        return html.Div(children, style={"padding": "8px"})
 
     def build_rake_path_block(self, rc):
         services = rc.servicePath
@@ -160,7 +428,7 @@ class Simulator:
         start = services[0].initStation.name
         end = services[-1].finalStation.name
 
-        ac = sum(1 for s in services if s.needsACRake)
+        ac = rc.acServiceCount
 
         return html.Details(
             [
@@ -190,7 +458,7 @@ class Simulator:
                 ),
 
                 html.Div(
-                    [self.build_service_row(svc, i < n - 1)
+                    [build_service_row(svc, i < n - 1)
                     for i, svc in enumerate(services)],
                     style={"marginLeft": "14px", "marginTop": "6px"}
                 )
@@ -204,7 +472,7 @@ class Simulator:
         for i, svc in enumerate(rc.servicePath, start=1):
             rows.append({
                 "seq": i,
-                "service_id": ", ".join(str(s) for s in svc.serviceId),
+                "service_id": svc.serviceIdStr,
                 "start": svc.initStation.name,
                 "end": svc.finalStation.name,
                 "ac": "AC" if svc.needsACRake else "Non-AC",
@@ -240,16 +508,13 @@ class Simulator:
         )
 
     def _reset_render_flags(self):
-        for rc in self.parser.wtt.rakecycles:
+        wtt = self.parser.wtt
+        for rc in wtt.rakecycles:
             rc.render = True
 
-        for svc in self.parser.wtt.suburbanServices:
-            if not svc.events:
-                svc.render = False
-                continue
-            svc.render = True
-            for ev in svc.events:
-                ev.render = True
+        for svc in wtt.suburbanServices:
+            svc.render = bool(svc.events)
+        wtt.eventRender[:] = True
 
     def _apply_filters(self, qq):
         if qq.type == FilterType.SERVICE:
@@ -268,17 +533,20 @@ class Simulator:
             scene=dict(aspectratio=dict(x=3, y=1.5, z=1.2))
         )
 
-        for i, rc in enumerate(self.parser.wtt.rakecycles):
-            for svc in rc.servicePath:
-                if i < len(self.parser.wtt.rakecycles)/2 + 10:
-                    svc.needsACRake = True
-
-        before = utils.corridorMixingMinimal(qq.startStation, qq.endStation, qq.inTimePeriod[0], qq.inTimePeriod[1])
-        after = utils.corridorMixingMinimal(qq.startStation, qq.endStation, qq.inTimePeriod[0], qq.inTimePeriod[1])
-
-        print("=== Mixing Report ===")
-        for b, a in zip(before, after):
-            print(f"{b['station']}: {b['mixing_score']:.3f} -> {a['mixing_score']:.3f}")
+        # first half (+10) of the links run AC; same links as i < n/2 + 10
+        rakecycles = self.parser.wtt.rakecycles
+        cutoff = (len(rakecycles) + 1) // 2 + 10
+        for svc in chain.from_iterable(rc.servicePath for rc in rakecycles[:cutoff]):
+            svc.needsACRake = True
+        self.parser.wtt.updateACServiceCounts()
+
+        # the report is only logged; skip walking the corridor when INFO is off
+        if logger.isEnabledFor(logging.INFO):
+            report = utils.corridorMixingMinimal(qq.startStation, qq.endStation, qq.inTimePeriod[0], qq.inTimePeriod[1])
+            logger.info("=== Mixing Report ===")
+            for r in report:
+                score = r['mixing_score']
+                logger.info("%s: %s", r['station'], 'n/a' if score is None else f'{score:.3f}')
 
         return fig
     
@@ -286,87 +554,52 @@ class Simulator:
         for rc in self.parser.wtt.rakecycles:
             rc.render = True
         fig.update_layout(annotations=[])
-        for tr in fig.data:
-            tr.opacity = 1.0
-            if hasattr(tr, "line"): tr.line.width = 2
-            if hasattr(tr, "marker"): tr.marker.size = 2
+        # every trace is a Scatter3d built by visualizeLinks3D,
+        # so line and marker always exist: one batched update
+        fig.update_traces(opacity=1.0, line_width=2, marker_size=2)
         return fig
 
-    def _highlight_clicked_services(self, fig, selected_services):
-        """
-        Highlight selected services in the visualization.
-        
-        Args:
-            fig: Plotly figure object
-            selected_services: List of service ID strings (e.g., ["93001", "93002"])
-        """
-        if not selected_services:
-            return
-        
-        selected_set = set(selected_services)
-        
-        for trace in fig.data:
-            # Trace names in service mode are "LinkName-ServiceID"
-            # e.g., "A-93001"
-            if '-' in trace.name:
-                trace_service = trace.name.split('-')[1]  # Extract service ID
-                
-                if trace_service in selected_set:
-                    # Highlight
-                    trace.opacity = 1.0
-                    if hasattr(trace, "marker"): 
-                        trace.marker.size = 3
-                else:
-                    # Dim
-                    trace.opacity = 0.35
-                    if hasattr(trace, "marker"): 
-                        trace.marker.size = 1
-            else:
-                # Not a service trace (maybe context traces), dim by default
-                trace.opacity = 0.35
-    
     def _highlight_clicked(self, fig, selected_links):
         """
         Highlight one or more rake links in the visualization.
         
         Args:
             fig: Plotly figure object
-            selected_links: Either a string (single link) or list of strings (multiple links)
+            selected_links: A string (single link), or a list/set of strings (multiple links)
         """
-        # Normalize to list for uniform handling
+        # Normalize to a set for O(1) per-trace membership
         if isinstance(selected_links, str):
             selected_links = [selected_links]
         
         if not selected_links:
-            # # No selection - reset all to normal
-            # for trace in fig.data:
-            #     trace.opacity = 1.0
-            #     if hasattr(trace, "line"): 
-            #         trace.line.width = 2
-            #     if hasattr(trace, "marker"): 
-            #         trace.marker.size = 2
             return
-        
-        selected_set = set(selected_links)
-        
-        for trace in fig.data:
-            # Extract base link name (handle "A" or "A-93001" format)
-            trace_link = trace.name.split('-')[0] if '-' in trace.name else trace.name
-            
-            if trace_link in selected_set:
-                # Highlight selected traces
-                trace.opacity = 1.0
-                # if hasattr(trace, "line"): 
-                #     trace.line.width = 4  # Thicker than default
-                if hasattr(trace, "marker"): 
-                    trace.marker.size = 3  # Larger than default
-            else:
-                # Dim unselected traces
-                trace.opacity = 0.35
-                # if hasattr(trace, "line"): 
-                #     trace.line.width = 2
-                if hasattr(trace, "marker"): 
-                    trace.marker.size = 1
+        if not isinstance(selected_links, frozenset):
+            selected_links = frozenset(selected_links)
+        self._apply_highlight(fig, selected_links, "link")
+
+    def _selection_mask(self, selected_set, mode):
+        """Per-trace membership of selected_set. Trace keys are
+        (LinkName, ServiceID), e.g. ("A", "93001"); mode picks which half."""
+        k = 0 if mode == "link" else 1
+        return [key[k] in selected_set for key in self._traceKeys]
+
+    def _apply_highlight(self, fig, selected_set, mode):
+        """Restyle every trace in one batch: selected traces at full
+        opacity with larger markers, the rest dimmed."""
+        mask = self._selection_mask(selected_set, mode)
+        fig.plotly_restyle({
+            "opacity": [1.0 if m else 0.35 for m in mask],
+            "marker.size": [3 if m else 1 for m in mask],
+        })
+
+    def _highlight_patch(self, selected_set, mode):
+        """Same restyle as _apply_highlight, as a Patch against the figure
+        already on the page, so only opacity/size travel to the browser."""
+        patch = dash.Patch()
+        for i, m in enumerate(self._selection_mask(selected_set, mode)):
+            patch["data"][i]["opacity"] = 1.0 if m else 0.35
+            patch["data"][i]["marker"]["size"] = 3 if m else 1
+        return patch
 
     def _build_annotation(self, rc):
         return [
@@ -408,21 +641,26 @@ class Simulator:
         
         converted = []
         
-        for rc in self.parser.wtt.rakecycles:
-            if rc.linkName in link_names:
-                # Skip if already AC
-                if rc.rake and rc.rake.isAC:
-                    continue
-                
-                # Convert the rake
-                if rc.rake:
-                    rc.rake.isAC = True
-                
-                # Convert all services in this rake cycle
-                for svc in rc.servicePath:
-                    svc.needsACRake = True
-                
-                converted.append(rc.linkName)
+        # look up only the selected links (deduped, selection order kept)
+        for name in dict.fromkeys(link_names):
+            rc = self._rcByLink.get(name)
+            if rc is None:
+                continue
+            # Skip if already AC
+            if rc.rake and rc.rake.isAC:
+                continue
+            
+            # Convert the rake
+            if rc.rake:
+                rc.rake.isAC = True
+            rc.acServiceCount = len(rc.servicePath)
+            
+            converted.append(rc)
+        
+        # Convert all services of the converted rake cycles in one pass
+        for svc in chain.from_iterable(rc.servicePath for rc in converted):
+            svc.needsACRake = True
+        converted = [rc.linkName for rc in converted]
         
         return {
             "converted": len(converted),
@@ -435,130 +673,87 @@ class Simulator:
         self._initFilterQueryCallbacks() 
 
     def _is_valid_xlsx(self, filename):
-        return bool(filename) and filename.lower().endswith(".xlsx")
+        # compare only the suffix instead of lowercasing the whole name
+        return bool(filename) and filename[-5:].lower() == ".xlsx"
+
+    def _decode_upload(self, contents):
+        '''dcc.Upload data URL -> BytesIO over the decoded file.
+        Decodes in chunks straight off the data URL so neither the base64
+        tail nor its ASCII-encoded copy is materialised in full.'''
+        buf = io.BytesIO()
+        start = contents.find(',') + 1
+        for i in range(start, len(contents), _B64_CHUNK):
+            buf.write(binascii.a2b_base64(contents[i:i + _B64_CHUNK]))
+        buf.seek(0)
+        return buf
+
+    def _digest(self, fileObj):
+        '''Short blake2b hex digest of a decoded upload.'''
+        with fileObj.getbuffer() as view:
+            return hashlib.blake2b(view, digest_size=16).hexdigest()
 
     def _initFilterQueryCallbacks(self):
-        '''Each UI filter updates self.query attributes directly.'''
-
-        # ---------------------------------------------------------------------
-        # Helper: handles both rakelink, service and station inputs in one place
-        # ---------------------------------------------------------------------
-        def _update_query_field(ctx, field, value_rakelink, value_service=None, value_station=None):
-            '''Update a FilterQuery field depending on which input triggered.'''
-            if not ctx.triggered:
-                return None
-            trigger = ctx.triggered[0]['prop_id'].split('.')[0]
-
-            # Choose correct source
-            if trigger.endswith('_service'):
-                setattr(self.query, field, value_service)
-            elif trigger.endswith('_station'):
-                setattr(self.query, field, value_station)
-            else:
-                setattr(self.query, field, value_rakelink)
-            return None
-
-        @self.app.callback(
-            Input('start-station', 'value'),
-            Input('start-station_service', 'value'),
-        )
-        def update_start_station(value_rakelink, value_service):
-            return _update_query_field(callback_context, 'startStation', value_rakelink, value_service)
-
-        @self.app.callback(
-            Input('end-station', 'value'),
-            Input('end-station_service', 'value'),
-        )
-        def update_end_station(value_rakelink, value_service):
-            return _update_query_field(callback_context, 'endStation', value_rakelink, value_service)
-
-        @self.app.callback(
-            Input('intermediate-stations', 'value'),
-            Input('intermediate-stations_service', 'value'),
-        )
-        def update_passing_through(value_rakelink, value_service):
-            v1 = value_rakelink or []
-            v2 = value_service or []
-            return _update_query_field(callback_context, 'passingThrough', v1, v2)
+        '''Each UI filter updates self.query through one dispatching callback.'''
 
         @self.app.callback(
-            Input('time-range-slider', 'value'),
-            Input('time-range-slider_service', 'value'),
-            Input('time-range-slider_station', 'value'),
-            prevent_initial_call=False
+            [Input(cid, 'value') for cid in _QUERY_INPUTS],
         )
-        def update_time_period(value_rakelink, value_service, value_station):
-            return _update_query_field(callback_context, 'inTimePeriod', value_rakelink, value_service, value_station)
-
-        @self.app.callback(
-            Input('ac-selector', 'value'),
-        )
-        def update_ac_filter(value_rakelink):
-            return _update_query_field(callback_context, 'ac', value_rakelink)
+        def update_query_fields(*values):
+            '''Copy whichever filter input(s) fired into the matching query field.'''
+            triggered = callback_context.triggered_prop_ids
+            if not triggered:
+                # initial load: only the direction switches start non-empty
+                self._update_query(inDirection=values[_QUERY_INPUT_POS['direction-selector']])
+                return None
 
-        @self.app.callback(
-            Input('direction-selector', 'value'),
-        )
-        def update_service_direction(value):
-            self.query.inDirection = value
+            changes = {}
+            for cid in triggered.values():
+                field = _QUERY_INPUTS[cid]
+                value = values[_QUERY_INPUT_POS[cid]]
+                if field == 'passingThrough':
+                    value = value or ()
+                changes[field] = value
+            self._update_query(**changes)
             return None
 
         @self.app.callback(
+            Output('app-state', 'data', allow_duplicate=True),
             Input('filter-tabs', 'active_tab'),
             State('time-range-slider', 'value'),
             State('time-range-slider_service', 'value'),
             State('time-range-slider_station', 'value'),
-        )
-        def update_query_type(active_tab, rk_time, svc_time, st_time):
-            # Update filter type
-            if active_tab == "tab-rakelink":
-                self.query.type = FilterType.RAKELINK
-                self.query.inTimePeriod = rk_time          # ← RESET TIME
-                self.query.inDirection = None
-
-            elif active_tab == "tab-service":
-                self.query.type = FilterType.SERVICE
-                self.query.inTimePeriod = svc_time         # ← RESET TIME
-
-            elif active_tab == "tab-station":
-                self.query.type = FilterType.STATION
-                self.query.inTimePeriod = st_time          # ← RESET TIME
-
-            return None
-
-        @self.app.callback(
-            Output('app-state', 'data', allow_duplicate=True),
-            Input('filter-tabs', 'active_tab'),
             prevent_initial_call=True 
         )
-        def update_query_type(active_tab):
+        def update_query_type(active_tab, rk_time, svc_time, st_time):
             # Save current filter state
             if self.query.type:
-                self.filterStates[self.query.type] = {
-                    'startStation': self.query.startStation,
-                    'endStation': self.query.endStation,
-                    'passingThrough': self.query.passingThrough.copy(),
-                    'inTimePeriod': self.query.inTimePeriod,
-                    'inDirection': self.query.inDirection,
-                }
+                self.filterStates[self.query.type] = self.query
             
-            # Update type
+            # Update type; the time window always follows the new tab's slider
+            ftype, period = self.query.type, self.query.inTimePeriod
             if active_tab == "tab-rakelink":
-                self.query.type = FilterType.RAKELINK
+                ftype, period = FilterType.RAKELINK, rk_time
             elif active_tab == "tab-service":
-                self.query.type = FilterType.SERVICE
+                ftype, period = FilterType.SERVICE, svc_time
             elif active_tab == "tab-station":
-                self.query.type = FilterType.STATION
+                ftype, period = FilterType.STATION, st_time
             
             # Restore saved state for new tab
-            saved = self.filterStates.get(self.query.type, {})
-            self.query.startStation = saved.get('startStation')
-            self.query.endStation = saved.get('endStation')
-            self.query.passingThrough = saved.get('passingThrough', [])
-            self.query.inTimePeriod = saved.get('inTimePeriod', (165, 1605))
-            self.query.inDirection = saved.get('inDirection')
+            saved = self.filterStates.get(ftype) or FilterQuery()
+            self._update_query(
+                type=ftype,
+                startStation=saved.startStation,
+                endStation=saved.endStation,
+                passingThrough=saved.passingThrough,
+                inTimePeriod=period,
+                # rake links have no direction filter
+                inDirection=None if ftype == FilterType.RAKELINK else saved.inDirection,
+            )
             
-            return None
+            # only the changed key goes back to the store
+            state = dash.Patch()
+            state["filterType"] = ftype.value if ftype else None
+            return state
         
     def _initFileUploadCallbacks(self):
         '''Handle file uploads and update UI'''
@@ -569,45 +764,24 @@ class Simulator:
             State('upload-wtt-inline', 'filename')
         )
         def update_wtt_filename(contents, filename):
-            base_style = {
-                "height": "140px",
-                "borderWidth": "2px",
-                "borderStyle": "dashed",
-                "borderRadius": "12px",
-                "borderColor": "#cbd5e1",
-                "display": "flex",
-                "alignItems": "center",
-                "justifyContent": "center",
-                "cursor": "pointer",
-                "transition": "all 0.2s ease",
-            }
             if contents is None:
                 return html.Div([
-                    html.Img(src="/assets/excel-icon.png",
-                            style={"width": "28px", "height": "28px", "marginBottom": "6px"}),
-                    html.Div("Full WTT",
-                            style={"fontWeight": "500", "color": "#334155", "fontSize": "14px"}),
-                    html.Div("Click to upload",
-                            style={"fontSize": "11px", "color": "#94a3b8", "marginTop": "4px"})
-                ], className="text-center"), base_style
+                    html.Img(src="/assets/excel-icon.png", style=UPLOAD_ICON_STYLE),
+                    html.Div("Full WTT", style=UPLOAD_TITLE_STYLE),
+                    html.Div("Click to upload", style=UPLOAD_HINT_STYLE)
+                ], className="text-center"), UPLOAD_STYLE
 
             # When uploaded
             self.wttContents = contents
             self.wttFileName = filename
             display_name = filename if len(filename) <= 40 else filename[:37] + "..."
             
-            success_style = copy.deepcopy(base_style)
-            success_style.update({
-                "borderStyle": "solid",
-                "borderColor": "#188038",  # Google Sheets green
-            })
-            
             return html.Div([
                 html.Img(src="/assets/excel-icon.png",
                         style={"width": "24px", "height": "24px", "marginBottom": "4px"}),
                 html.Div(display_name,
                         style={"fontSize": "11px", "color": "#188038", "fontWeight": "500", "wordBreak": "break-all"})
-            ], className="text-center"), success_style
+            ], className="text-center"), UPLOAD_SUCCESS_STYLE
 
         @self.app.callback(
             Output('upload-summary-inline', 'children'),
@@ -615,89 +789,77 @@ class Simulator:
             Input('upload-summary-inline', 'contents'),
             State('upload-summary-inline', 'filename')
         )
-        def update_summary_filename(contents, filename):            
-            base_style = {
-                "height": "140px",
-                "borderWidth": "2px",
-                "borderStyle": "dashed",
-                "borderRadius": "12px",
-                "borderColor": "#cbd5e1",
-                "display": "flex",
-                "alignItems": "center",
-                "justifyContent": "center",
-                "cursor": "pointer",
-                "transition": "all 0.2s ease",
-            }
+        def update_summary_filename(contents, filename):
             if contents is None:
                 return html.Div([
-                    html.Img(src="/assets/excel-icon.png",
-                            style={"width": "28px", "height": "28px", "marginBottom": "6px"}),
-                    html.Div("WTT Link Summary",
-                            style={"fontWeight": "500", "color": "#334155", "fontSize": "14px"}),
-                    html.Div("Click to upload",
-                            style={"fontSize": "11px", "color": "#94a3b8", "marginTop": "4px"})
-                ], className="text-center"), base_style
+                    html.Img(src="/assets/excel-icon.png", style=UPLOAD_ICON_STYLE),
+                    html.Div("WTT Link Summary", style=UPLOAD_TITLE_STYLE),
+                    html.Div("Click to upload", style=UPLOAD_HINT_STYLE)
+                ], className="text-center"), UPLOAD_STYLE
             
             self.summaryContents = contents
             self.summaryFileName = filename
             # Truncate long filenames
             display_name = filename if len(filename) <= 40 else filename[:37] + "..."
             
-            success_style = copy.deepcopy(base_style)
-            success_style.update({
-                "borderStyle": "solid",
-                "borderColor": "#188038",  # Google Sheets green
-            })
-            
             return html.Div([
                 html.Img(src="/assets/excel-icon.png",
                         style={"width": "24px", "height": "24px", "marginBottom": "4px"}),
                 html.Div(display_name,
                         style={"fontSize": "11px", "color": "#188038", "fontWeight": "500", "wordBreak": "break-all"})
-            ], className="text-center"), success_style
-
-        @self.app.callback(
+            ], className="text-center"), UPLOAD_SUCCESS_STYLE
+
+        # Enabling the generate button and filters only needs to know that
+        # both uploads are present, so it is decided in the browser instead
+        # of posting both base64 files to the server.
+        base_style = {
+            "border": "none",
+            "width": "100%",
+            "height": "42px",
+            "borderRadius": "8px",
+            # "border": "dashed",
+            "fontWeight": "600",
+            "fontSize": "14px",
+            "cursor": "pointer",
+            "transition": "all 0.2s ease",
+        }
+        enabled_style = base_style | {"opacity": "1"}
+        disabled_style = base_style | {
+            "color": "#94a3b8",
+            "cursor": "not-allowed",
+            "opacity": "0.65",
+        }
+        self.app.clientside_callback(
+            """
+            function(wtt, summary) {
+                const ready = wtt != null && summary != null;
+                return [!ready, ready ? %s : %s];
+            }
+            """ % (json.dumps(enabled_style), json.dumps(disabled_style)),
             Output('generate-button', 'disabled'),
             Output('generate-button', 'style'),
             [Input('upload-wtt-inline', 'contents'),
             Input('upload-summary-inline', 'contents')]
         )
-        def enable_generate_button(wtt_contents, summary_contents):
-            '''Enable button only when both files are uploaded'''
-            base_style = {
-                "border": "none",
-                "width": "100%",
-                "height": "42px",
-                "borderRadius": "8px",
-                # "border": "dashed",
-                "fontWeight": "600",
-                "fontSize": "14px",
-                "cursor": "pointer",
-                "transition": "all 0.2s ease",
-            }
-
-            if wtt_contents is not None and summary_contents is not None:
-                # Both uploaded → enable + green border
-                enabled_style = base_style | {
-                    # "border": "2px solid #188038",
-                    # "backgroundColor": "white",
-                    # "color": "#188038",
-                    "opacity":"1",
-                }
-                return False, enabled_style
-            else:
-                # Default → disabled grayish border
-                disabled_style = base_style | {
-                    # "border": "2px solid #cbd5e1",
-                    # "backgroundColor": "#f1f5f9",
-                    "color": "#94a3b8",
-                    # "cursor": "not-allowed",
-                    "cursor": "not-allowed",
-                    "opacity": "0.65",
-                }
-                return True, disabled_style
 
-        @self.app.callback(
+        overlay_style = {
+            "position": "absolute",
+            "top": "0",
+            "left": "0",
+            "right": "0",
+            "bottom": "0",
+            "backgroundColor": "rgba(243, 246, 250, 0.7)",
+            "zIndex": "10",
+            "cursor": "not-allowed",
+            "borderRadius": "12px"
+        }
+        self.app.clientside_callback(
+            """
+            function(wtt, summary) {
+                const off = wtt == null || summary == null;
+                return [off, off, off, off, off ? %s : {display: "none"}];
+            }
+            """ % json.dumps(overlay_style),
             [Output('start-station', 'disabled'),
             Output('end-station', 'disabled'),
             Output('intermediate-stations', 'disabled'),
@@ -706,62 +868,59 @@ class Simulator:
             [Input('upload-wtt-inline', 'contents'),
             Input('upload-summary-inline', 'contents')]
         )
-        def toggle_filters(wtt_contents, summary_contents):
-            '''Enable filters only when both files are uploaded'''
-            if wtt_contents is not None and summary_contents is not None:
-                # Both uploaded -> enable filters
-                overlay_style = {"display": "none"}
-                return False, False, False, False, overlay_style
-            else:
-                # Not uploaded -> disable filters
-                overlay_style = {
-                    "position": "absolute",
-                    "top": "0",
-                    "left": "0",
-                    "right": "0",
-                    "bottom": "0",
-                    "backgroundColor": "rgba(243, 246, 250, 0.7)",
-                    "zIndex": "10",
-                    "cursor": "not-allowed",
-                    "borderRadius": "12px"
-                }
-                return True, True, True, True, overlay_style
         
         @self.app.callback(
             [Output('app-state', 'data'),
-            Output('start-station', 'options'),
-            Output('end-station', 'options'),
-            Output('intermediate-stations', 'options'),
-            Output('start-station_service', 'options'),
-            Output('end-station_service', 'options'),
-            Output('intermediate-stations_service', 'options')],  
+            Output('station-options', 'data')],
             Input('upload-wtt-inline', 'contents')
         )
         def initFilters(wttContents):
             if not self._is_valid_xlsx(self.wttFileName):
                 raise PreventUpdate
             if not wttContents:
-                return None,[],[],[],[],[],[] # should never reach here
+                return None, [] # should never reach here
             
-            wttDecoded = base64.b64decode(wttContents.split(',')[1])
-            wttIO = io.BytesIO(wttDecoded)
+            wttIO = self._decode_upload(wttContents)
+            digest = self._digest(wttIO)
 
             if not self.parser:
                 self.parser = tt.TimeTableParser()
 
-            # register stations
-            self.parser.xlsxToDfFromFileObj(wttIO)
-            self.parser.registerStations()
-
-            stations = [s for s in self.parser.wtt.stations]
-            options = [{"label": s, "value": s} for s in stations]
-
-            return {"initialized": True}, options, options, options, options, options, options
+            # register stations, unless this exact WTT is already parsed
+            if digest != self._wttDigest:
+                self.parser.xlsxToDfFromFileObj(wttIO, cacheKey=f"wtt-{digest}")
+                self.parser.registerStations()
+                self._wttDigest = digest
+
+                stations = tuple(self.parser.wtt.stations)
+                if stations != self._stationOptions[0]:
+                    options = [{"label": s, "value": s} for s in stations]
+                    self._stationOptions = (stations, options)
+
+            state = dash.Patch()
+            state["initialized"] = True
+            return state, self._stationOptions[1]
+
+        # Station options are sent once in the store and copied into
+        # every station dropdown in the browser.
+        self.app.clientside_callback(
+            "function(opts) { return Array(6).fill(opts || []); }",
+            Output('start-station', 'options'),
+            Output('end-station', 'options'),
+            Output('intermediate-stations', 'options'),
+            Output('start-station_service', 'options'),
+            Output('end-station_service', 'options'),
+            Output('intermediate-stations_service', 'options'),
+            Input('station-options', 'data'),
+        )
 
 
+        # Parsing stays in-process (the parser lives on self), so instead of a
+        # background worker the status line reports progress while it runs.
         @self.app.callback(
             [Input('upload-wtt-inline', 'contents'),
             Input('upload-summary-inline', 'contents')],
+            running=[(Output('status-div', 'children'), "Parsing uploaded timetable…", "")],
             prevent_initial_call=True
         )
         def initBackend(wttContents, summaryContents):
@@ -775,15 +934,20 @@ class Simulator:
                 raise PreventUpdate
             
             try:
-                summaryDecoded = base64.b64decode(summaryContents.split(',')[1])
-                summaryIO = io.BytesIO(summaryDecoded)
+                summaryIO = self._decode_upload(summaryContents)
+                digests = (self._wttDigest, self._digest(summaryIO))
+                # same WTT + summary as the current backend: nothing to redo
+                if digests == self._backendDigests:
+                    return
                 
                 self.parser.registerServices()
-                self.parser.parseWttSummaryFromFileObj(summaryIO)
+                self.parser.parseWttSummaryFromFileObj(summaryIO, cacheKey=f"summary-{digests[1]}")
                 self.parser.wtt.suburbanServices = self.parser.isolateSuburbanServices()
+                self._on_wtt_loaded()
+                self._backendDigests = digests
             
             except Exception as e:
-                print(f"Error initializing backend: {e}")
+                logger.error("Error initializing backend: %s", e)
                 return 
 
     def _initButtonCallbacks(self): 
@@ -792,10 +956,9 @@ class Simulator:
             Output('rake-link-table', 'data', allow_duplicate=True),
             Output('status-div', 'children', allow_duplicate=True),
             Input('reset-ac-button', 'n_clicks'),
-            State('rake-3d-graph', 'figure'),
             prevent_initial_call=True
         )
-        def reset_ac_conversions(n_clicks, current_fig):
+        def reset_ac_conversions(n_clicks):
             """Reset all AC conversions to original state from data"""
             if not n_clicks:
                 raise PreventUpdate
@@ -809,27 +972,25 @@ class Simulator:
             )
             
             raise PreventUpdate  # Implement full reset logic as needed
-        @self.app.callback(
+        # Enable Convert to AC only when non-AC links are selected in rakelink
+        # mode; everything it needs is already in the browser.
+        self.app.clientside_callback(
+            """
+            function(selected_rows, active_tab, table_data) {
+                if (active_tab !== "tab-rakelink" || !selected_rows || !selected_rows.length || !table_data) {
+                    return true;
+                }
+                return !selected_rows.some(
+                    idx => idx < table_data.length && table_data[idx].is_ac === "Non-AC"
+                );
+            }
+            """,
             Output('convert-ac-button', 'disabled'),
             Input('rake-link-table', 'selected_rows'),
             Input("filter-tabs", "active_tab"),
             State('rake-link-table', 'data'),
             prevent_initial_call=True
         )
-        def toggle_convert_button(selected_rows, active_tab, table_data):
-            """Enable Convert to AC button only when non-AC links are selected in rakelink mode"""
-            if active_tab != "tab-rakelink" or not selected_rows or not table_data:
-                return True
-            
-            # Check if any selected link is non-AC
-            has_nonac = False
-            for idx in selected_rows:
-                if idx < len(table_data):
-                    if table_data[idx]["is_ac"] == "Non-AC":
-                        has_nonac = True
-                        break
-            
-            return not has_nonac  # Enable if we have at least one non-AC link
 
         @self.app.callback(
             Output('rake-3d-graph', 'figure', allow_duplicate=True),
@@ -837,40 +998,50 @@ class Simulator:
             Output('status-div', 'children', allow_duplicate=True),
             Input('convert-ac-button', 'n_clicks'),
             State('rake-link-table', 'selected_rows'),
-            State('rake-link-table', 'data'),
-            State('rake-3d-graph', 'figure'),
             prevent_initial_call=True
         )
-        def handle_ac_conversion(n_clicks, selected_rows, table_data, current_fig):
+        def handle_ac_conversion(n_clicks, selected_rows):
             """Convert selected rake links to AC and update visualization"""
-            if not n_clicks or not selected_rows or not table_data:
+            if not n_clicks or not selected_rows or not self._rakeRowNames:
                 raise PreventUpdate
             
             # Get selected link names
-            selected_links = [
-                table_data[idx]["linkname"] 
-                for idx in selected_rows 
-                if idx < len(table_data)
-            ]
+            selected_links = self._selected_names(self._rakeRowNames, selected_rows)
             
             # Perform conversion
             result = self.convertRakeLinksToAC(selected_links)
+            # cached figures carry the old AC colours
+            self._figCache.clear()
+            self._rowCache.clear()
+            self._panelCache.clear()
+            self._tablesKey = None
             
-            # Update table data (mark converted links as AC)
-            updated_table = table_data.copy()
-            for row in updated_table:
-                if row["linkname"] in result["links"]:
-                    row["is_ac"] = "AC"
+            # Patch only the converted rows' AC cell instead of resending the table;
+            # rows are located through the linkname index, not a scan of the table
+            converted = frozenset(result["links"])
+            updated_table = dash.Patch()
+            for link in converted:
+                idx = self._rakeRowIndex.get(link)
+                if idx is not None:
+                    updated_table[idx]["is_ac"] = "AC"
             
-            # Regenerate visualization with updated data
-            self._reset_render_flags()
-            self._apply_filters(self.query)
-            fig = self.visualizeLinks3D()
-            fig = self._post_process_station_mode(fig, self.query)
-            
-            # Re-apply highlighting if there were selections
-            if self.query.selectedLinks:
-                self._highlight_clicked(fig, self.query.selectedLinks)
+            qq = self.query
+            if qq.ac in (None, "all") and qq.type != FilterType.STATION:
+                # Same traces stay visible, only the converted links recolour
+                fig = self._ac_color_patch(converted)
+            else:
+                # AC filter / station recolouring can change what is drawn:
+                # regenerate visualization with updated data
+                self._reset_render_flags()
+                self._apply_filters(qq)
+                # built outside the figure cache: the next Generate resets
+                # the AC states, so this converted figure must not be reused
+                fig = self.visualizeLinks3D()
+                fig = self._post_process_station_mode(fig, qq)
+                
+                # Re-apply highlighting if there were selections
+                if qq.selectedLinks:
+                    self._highlight_clicked(fig, qq.selectedLinkSet)
             
             # Status message
             status_msg = html.Div(
@@ -890,89 +1061,73 @@ class Simulator:
             
             return fig, updated_table, status_msg
 
-        @self.app.callback(
-            Output("rake-link-table-container", "style"),  
-            Output("service-table-container", "style"),
+        # Which tab is active and which table is shown are pure UI state,
+        # kept in the browser to skip a server round-trip per tab click.
+        self.app.clientside_callback(
+            "function(tab) { return tab; }",
+            Output("active-tab-store", "data"),
             Input("filter-tabs", "active_tab"),
-            Input("graph-ready", "data")
         )
-        def toggle_table_display(active_tab, graph_ready):
-            if not graph_ready:
-                return {"display": "none"}, {"display": "none"}
-            
-            if active_tab == "tab-service":
-                # Hide rake table, show service table
-                return {"display": "none"}, {"padding": "10px 0px", "display": "block"}
-            else:
-                # Show rake table, hide service table (default for rake-link and station modes)
-                return {"padding": "10px 0px", "display": "block"}, {"display": "none"}       
+
+        self.app.clientside_callback(
+            """
+            function(activeTab, graphReady) {
+                const hidden = {"display": "none"};
+                const shown = {"padding": "10px 0px", "display": "block"};
+                if (!graphReady) {
+                    return [hidden, hidden];
+                }
+                // rake table for rake-link and station modes, service table otherwise
+                return activeTab === "tab-service" ? [hidden, shown] : [shown, hidden];
+            }
+            """,
+            Output("rake-link-table-container", "style"),
+            Output("service-table-container", "style"),
+            Input("active-tab-store", "data"),
+            Input("graph-ready", "data"),
+        )
         
         @self.app.callback(
             Output('rake-3d-graph', 'figure', allow_duplicate=True),
             Input('service-table', 'selected_rows'),
-            State('rake-3d-graph', 'figure'),
-            State('service-table', 'data'),
             State("filter-tabs", "active_tab"),
             prevent_initial_call=True
         )
-        def update_graph_from_service_selection(selected_rows, current_fig, table_data, active_tab):
-            if active_tab != "tab-service" or current_fig is None or not current_fig.get('data'):
+        def update_graph_from_service_selection(selected_rows, active_tab):
+            # _traceKeys is empty until a figure with traces has been sent
+            if active_tab != "tab-service" or not self._traceKeys:
                 raise PreventUpdate
             
             # Extract selected service IDs
-            if not selected_rows or not table_data:
-                selected_services = []
-            else:
-                selected_services = [
-                    table_data[idx]["service_id"] 
-                    for idx in selected_rows 
-                    if idx < len(table_data)
-                ]
+            selected_services = self._selected_names(self._svcRowNames, selected_rows)
             
             # Update query state
-            self.query.selectedServices = selected_services
+            self._update_query(selectedServices=selected_services)
             
             # Apply highlighting
-            fig = go.Figure(current_fig)
-            self._highlight_clicked_services(fig, selected_services)
-            
-            return fig
+            if not selected_services:
+                return dash.no_update
+            return self._highlight_patch(self.query.selectedServiceSet, "service")
 
         @self.app.callback(
             Output("service-table", "selected_rows"),
             Input("rake-3d-graph", "clickData"),
-            State("service-table", "data"),
             State("service-table", "selected_rows"),
             State("filter-tabs", "active_tab"),
             prevent_initial_call=True,
         )
-        def toggle_service_from_graph(clickData, table_rows, current_selection, active_tab):
-            if active_tab != "tab-service" or not clickData or not table_rows:
+        def toggle_service_from_graph(clickData, current_selection, active_tab):
+            if active_tab != "tab-service" or not clickData or not self._svcRowNames:
                 return current_selection or []
             
-            try:
-                # Extract service ID from hover text
-                # Format is "LinkName-ServiceID: Station @ Time"
-                hover_text = clickData["points"][0].get("hovertext", "")
-                
-                # Parse "A-93001: VIRAR @ 02:45" → "93001"
-                parts = hover_text.split(':')[0].strip()  # "A-93001"
-                if '-' in parts:
-                    clicked_service = parts.split('-')[1]  # "93001"
-                else:
-                    return current_selection or []
-                
-            except (KeyError, IndexError) as e:
-                print(f"Error extracting clicked service: {e}")
+            # Service traces carry the joined id string ("93001,93002");
+            # context traces have no service and are not selectable
+            key = self._clicked_trace_key(clickData)
+            if key is None or key[1] is None:
                 return current_selection or []
             
             # Find row index for this service
-            clicked_idx = None
-            for idx, row in enumerate(table_rows):
-                if clicked_service in row.get("service_id", ""):
-                    clicked_idx = idx
-                    break
-            
+            clicked_idx = self._svcRowIndex.get(key[1].split(',')[0])
             if clicked_idx is None:
                 return current_selection or []
             
@@ -985,227 +1140,104 @@ class Simulator:
             
             return selected
             
+        # One callback per rake-link selection change: the query, the store,
+        # the highlight and the Query Info panel all follow from the same
+        # link names, and the panel must see the updated query.
         @self.app.callback(
             Output('rake-3d-graph', 'figure', allow_duplicate=True),
+            Output('app-state', 'data', allow_duplicate=True),  # Reuse existing store
+            Output("right-panel-content", "children", allow_duplicate=True),
             Input('rake-link-table', 'selected_rows'),
-            State('rake-3d-graph', 'figure'),
-            State('rake-link-table', 'data'),
+            State("mode-details", "active"),
             prevent_initial_call=True
         )
-        def update_graph_highlighting(selected_rows, current_fig, table_data):
-            """Update graph highlighting when selection changes without regenerating the entire plot"""
-            if current_fig is None or not current_fig.get('data'):
-                raise PreventUpdate
-            
+        def update_link_selection(selected_rows, details_active):
+            """Sync self.query.selectedLinks, highlight without regenerating
+            the plot, and refresh Query Info if it is being viewed"""
             # Extract selected link names
-            if not selected_rows or not table_data:
-                selected_links = []
-            else:
-                selected_links = [
-                    table_data[idx]["linkname"] 
-                    for idx in selected_rows 
-                    if idx < len(table_data)
-                ]
+            selected_links = self._selected_names(self._rakeRowNames, selected_rows)
             
             # Update the query state
-            self.query.selectedLinks = selected_links
+            self._update_query(selectedLinks=selected_links)
+            state = dash.Patch()
+            state["selectedLinks"] = selected_links
             
-            # Apply highlighting to the existing figure
-            fig = go.Figure(current_fig)
-            self._highlight_clicked(fig, selected_links)
-            
-            return fig 
-
-        @self.app.callback(
-            Output("service-table", "data"),
-            Output("service-count", "children"),
-            Input('generate-button', 'n_clicks'),
-            Input('ac-selector', 'value'),
-            State("filter-tabs", "active_tab"),
-            prevent_initial_call=True
-        )
-        def build_service_table(n_clicks, ac_select, active_tab):
-            is_service_mode = (
-                active_tab == "tab-service" or 
-                self.query.type == FilterType.SERVICE
-            )
-
-            if n_clicks == 0 or self.parser is None or not is_service_mode:
-                return [], ""
-            
-            rows = []
-            for svc in self.parser.wtt.suburbanServices:
-                if not svc.render or not svc.events:
-                    continue
-                
-                # Get service details
-                svc_id_str = ','.join(str(sid) for sid in svc.serviceId)
-                start_time = fmt_time(svc.events[0].atTime) if svc.events else "--:--"
-                
-                # Find which rake link this service belongs to
-                rake_link = "?"
-                for rc in self.parser.wtt.rakecycles:
-                    if svc in rc.servicePath:
-                        rake_link = rc.linkName
-                        break
-                
-                rows.append({
-                    "id": svc_id_str,  # Used for selection tracking
-                    "service_id": svc_id_str,
-                    "direction": svc.direction.name if svc.direction else "?",
-                    "is_ac": "AC" if svc.needsACRake else "Non-AC",
-                    "cars": svc.rakeSizeReq if svc.rakeSizeReq else "?",
-                    "start_station": svc.initStation.name if svc.initStation else "?",
-                    "end_station": svc.finalStation.name if svc.finalStation else "?",
-                    "start_time": start_time,
-                    "rake_link": rake_link,
-                })
-            
-            return rows, f"{len(rows)} services"
-        
-        @self.app.callback(
-            Output("rake-link-table", "data"),
-            Output("rl-table-store", "data"),
-            Output("rake-link-count", "children"),
-            Input('generate-button', 'n_clicks'),
-            Input('ac-selector', 'value'),
-            State('upload-wtt-inline', 'contents'),
-            State('upload-summary-inline', 'contents'),
-            prevent_initial_call=True
-        )
-        def build_rake_table(n_clicks, ac_select, wttContents, summaryContents):
-            time.sleep(2)
-            if n_clicks == 0 or self.parser is None:
-                return [], [], ""
-
-            rows = []
-            for rc in self.parser.wtt.rakecycles:
-                if not rc.render or rc.rake is None:
-                    continue
-
-                rows.append({
-                    "id": rc.linkName,
-                    "linkname": rc.linkName,
-                    "cars": rc.rake.rakeSize,
-                    "is_ac": "AC" if rc.rake.isAC else "Non-AC",
-                    "length_km": int(rc.lengthKm),
-                    "start": rc.servicePath[0].initStation.name,
-                    "end": rc.servicePath[-1].finalStation.name,
-                    "n_services": len(rc.servicePath),
-                })
-
-            return rows, rows, f"{len(rows)} rake links"
-
-        @self.app.callback(
-            Output("right-panel-content", "children", allow_duplicate=True),
-            Input('rake-link-table', 'selected_rows'),
-            State("mode-details", "active"),
-            prevent_initial_call=True
-        )
-        def update_query_info_on_selection(selected_rows, details_active):
-            """Update Query Info panel content when selection changes, but only if already viewing it"""
-            if not details_active:
-                # Don't update if we're not viewing Query Info
-                raise PreventUpdate
+            # Patch highlighting onto the existing figure;
+            # _traceKeys is empty until a figure with traces has been sent
+            if not selected_links or not self._traceKeys:
+                fig = dash.no_update
+            else:
+                fig = self._highlight_patch(self.query.selectedLinkSet, "link")
             
-            # We're viewing Query Info, so update it
-            return self.build_query_info_panel()
+            # Only rebuild Query Info if we're viewing it
+            panel = self.build_query_info_panel() if details_active else dash.no_update
+            return fig, state, panel
 
         @self.app.callback(
             Output("rake-link-table", "selected_rows"),
             Input("rake-3d-graph", "clickData"),
-            State("rake-link-table", "data"),
             State("rake-link-table", "selected_rows"),
             prevent_initial_call=True,
         )
-        def toggle_row_from_graph(clickData, table_rows, current_selection):
+        def toggle_row_from_graph(clickData, current_selection):
             """Add/remove clicked trace from selection"""
-            if not clickData or not table_rows:
+            if not clickData or not self._rakeRowNames:
                 return current_selection or []
             
             # Get clicked link name from the trace
-            try:
-                # The trace name is stored in the 'name' property of the clicked point's trace
-                curve_number = clickData["points"][0].get("curveNumber")
-                # We need to get the actual trace name from the figure, but we can't access it here
-                # Instead, use hovertext which contains the link name
-                hover_text = clickData["points"][0].get("hovertext", "")
-                
-                # Format is "LinkName: Station @ Time" or "LinkName-ServiceID: Station @ Time"
-                clicked_link = hover_text.split(':')[0].strip()
-                
-                # Handle service-level traces (format: "A-93001" -> "A")
-                clicked_link = clicked_link.split('-')[0]
-                
-                print(f"Clicked link from graph: {clicked_link}")
-                
-            except (KeyError, IndexError) as e:
-                print(f"Error extracting clicked link: {e}")
+            key = self._clicked_trace_key(clickData)
+            if key is None:
                 return current_selection or []
+            clicked_link = key[0]
+            logger.debug("Clicked link from graph: %s", clicked_link)
             
             # Find row index for this link
-            clicked_idx = None
-            for idx, row in enumerate(table_rows):
-                if row.get("linkname") == clicked_link:
-                    clicked_idx = idx
-                    break
-            
+            clicked_idx = self._rakeRowIndex.get(clicked_link)
             if clicked_idx is None:
-                print(f"Link {clicked_link} not found in table")
+                logger.debug("Link %s not found in table", clicked_link)
                 return current_selection or []
             
             # Toggle: add if not present, remove if present
             selected = list(current_selection or [])
             if clicked_idx in selected:
                 selected.remove(clicked_idx)
-                print(f"Removed {clicked_link} from selection")
+                logger.debug("Removed %s from selection", clicked_link)
             else:
                 selected.append(clicked_idx)
-                print(f"Added {clicked_link} to selection")
+                logger.debug("Added %s to selection", clicked_link)
             
             return selected
         
 
-        @self.app.callback(
-            Output('app-state', 'data', allow_duplicate=True),  # Reuse existing store
-            Input('rake-link-table', 'selected_rows'),
-            State('rake-link-table', 'data'),
-            prevent_initial_call=True
-        )
-        def update_selected_rakes(selected_rows, table_data):
-            """Update self.query.selectedLinks when table selection changes"""
-            if not selected_rows or not table_data:
-                self.query.selectedLinks = []
-                return {"selectedLinks": []}
-            
-            # Extract link names from selected rows
-            selected_links = [
-                table_data[idx]["linkname"] 
-                for idx in selected_rows 
-                if idx < len(table_data)
-            ]
-            
-            self.query.selectedLinks = selected_links
-            return {"selectedLinks": selected_links}
-
-        @self.app.callback(
+        # Panel visibility and button states switch in the browser; only the
+        # Query Info content below needs the server.
+        self.app.clientside_callback(
+            """
+            function(viz_clicks, details_clicks) {
+                const ctx = window.dash_clientside.callback_context;
+                // Only switch when buttons are clicked, NOT when selection changes
+                if (ctx.triggered_id === "mode-details") {
+                    return [{display: "none"}, window.dash_clientside.no_update, false, true];
+                }
+                // Default: show visualization
+                return [{display: "block"}, null, true, false];
+            }
+            """,
             Output("viz-container", "style"),
             Output("right-panel-content", "children"),
             Output("mode-viz", "active"),
             Output("mode-details", "active"),
             Input("mode-viz", "n_clicks"),
             Input("mode-details", "n_clicks"),
-            # REMOVED: Input('rake-link-table', 'selected_rows')  <-- This was the problem!
         )
-        def switch_right_panel(viz_clicks, details_clicks):
-            ctx = dash.callback_context.triggered_id
-            
-            # Only switch when buttons are clicked, NOT when selection changes
-            if ctx == "mode-details":
-                return {"display": "none"}, self.build_query_info_panel(), False, True
 
-            # Default: show visualization
-            return {"display": "block"}, html.Div(), True, False
+        @self.app.callback(
+            Output("right-panel-content", "children", allow_duplicate=True),
+            Input("mode-details", "n_clicks"),
+            prevent_initial_call=True
+        )
+        def show_query_info(details_clicks):
+            return self.build_query_info_panel()
            
         @self.app.callback(
             Output('status-div', 'children'),
@@ -1214,24 +1246,35 @@ class Simulator:
             Output("graph-ready", "data"),
             Output("rake-link-table", "selected_rows", allow_duplicate=True),  
             Output("service-table", "selected_rows", allow_duplicate=True),    
+            # tables are filled here, after the render flags are final
+            Output("rake-link-table", "data"),
+            Output("rl-table-store", "data"),
+            Output("rake-link-count", "children"),
+            Output("service-table", "data"),
+            Output("service-count", "children"),
             Input('generate-button', 'n_clicks'),
             Input('rake-3d-graph', 'clickData'),
             Input('ac-selector', 'value'),
             State('upload-wtt-inline', 'contents'),
             State('upload-summary-inline', 'contents'),
+            # className, not disabled: the clientside upload check owns disabled
+            running=[(Output('generate-button', 'className'),
+                      "generate-button generating", "generate-button")],
             prevent_initial_call=True
         )
         def onGenerateClick(n_clicks, clickData, ac_status, wttContents, summaryContents):
+            import plotly.graph_objs as go
 
             if n_clicks == 0 or wttContents is None or summaryContents is None:
-                return "", go.Figure(), True, False, [], []
+                self._traceKeys = []
+                self._rakeRowIndex, self._svcRowIndex = {}, {}
+                self._rakeRowNames = self._svcRowNames = ()
+                self._tablesKey = None
+                return "", go.Figure(), True, False, [], [], [], [], "", [], ""
 
             try:
                 # Sync AC filter
-                self.query.ac = ac_status
-
-                self.query.selectedLinks = []
-                self.query.selectedServices = []
+                self._update_query(ac=ac_status, selectedLinks=(), selectedServices=())
                 qq = self.query
 
                 # First-time backend build
@@ -1239,6 +1282,8 @@ class Simulator:
                     self.parser.wtt.generateRakeCycles()
                     self.parser.wtt.storeOriginalACStates() 
                     self.linkTimingsCreated = True
+                    # invalid links were dropped, refresh the indices
+                    self._on_wtt_loaded()
                 else:
                     self.parser.wtt.resetACStates()
 
@@ -1248,14 +1293,17 @@ class Simulator:
                 # Apply filters
                 self._apply_filters(qq)
 
-                # Generate base plot
-                fig = self.visualizeLinks3D()
+                # Generate base plot (cached per filter query)
+                fig = self._build_base_figure(qq)
 
                 # Station mode post-processing
                 fig = self._post_process_station_mode(fig, qq)
 
                 if self.query.selectedLinks:
-                    self._highlight_clicked(fig, self.query.selectedLinks)
+                    fig = go.Figure(fig)  # keep the cached base figure unhighlighted
+                    self._highlight_clicked(fig, self.query.selectedLinkSet)
+                else:
+                    fig = self._figure_payload(qq, fig)
 
                 # Handle clicking a rake-link trace
                 # ctx = callback_context
@@ -1291,13 +1339,36 @@ class Simulator:
 
                     # return html.Div(), fig, False, True
 
+                # a graph click leaves the filters, and so the tables, as they
+                # were sent: skip re-serialising both tables and the store
+                tablesKey = (self._backendDigests, self._query_key(qq))
+                if callback_context.triggered_id == "rake-3d-graph" and tablesKey == self._tablesKey:
+                    tables = (dash.no_update,) * 5
+                else:
+                    rake_rows, self._rakeRowIndex = self._rake_table_rows(qq)
+                    self._rakeRowNames = tuple(row["linkname"] for row in rake_rows)
+                    if qq.type == FilterType.SERVICE:
+                        svc_rows, self._svcRowIndex = self._service_table_rows(qq)
+                        svc_count = f"{len(svc_rows)} services"
+                    else:
+                        svc_rows, svc_count = [], ""
+                        self._svcRowIndex = {}
+                    self._svcRowNames = tuple(row["service_id"] for row in svc_rows)
+                    self._tablesKey = tablesKey
+                    tables = (rake_rows, rake_rows, f"{len(rake_rows)} rake links",
+                              svc_rows, svc_count)
+
                 # Default final return
-                return html.Div(), fig, False, True, [], []
+                return (html.Div(), fig, False, True, [], []) + tables
 
             except Exception as e:
                 import traceback
                 traceback.print_exc()
-                return (html.Div(f"Error: {e}"), go.Figure(), True, False, [], [])
+                self._traceKeys = []
+                self._tablesKey = None
+                return (html.Div(f"Error: {e}"), go.Figure(), True, False, [], [],
+                        dash.no_update, dash.no_update, dash.no_update,
+                        dash.no_update, dash.no_update)
 
     
         @self.app.callback(
@@ -1313,70 +1384,54 @@ class Simulator:
             filename = f"wtt_report_{filter_type}_{timestamp}.txt"
             filename_xlsx = f"WTT_Export_{filter_type}_{timestamp}.xlsx"
 
-            # Use dcc.send_data_frame to export to Excel
-            report_xlsx = self.exportXlsx()
-            return dcc.send_data_frame(report_xlsx.to_excel, filename_xlsx, index=False)
+            # exportXlsx streams the workbook into a buffer; send it as-is
+            return dcc.send_bytes(self.exportXlsx, filename_xlsx)
             
             # report_content = self.exportResults() 
             
             # return dict(content=report_content, filename=filename)
         
         
+    def _station_times(self, stn):
+        '''Sorted array of the parsed event times at stn, built once per WTT.'''
+        entry = tt.TimeTableParser.stationEventIndex.get(stn)
+        return entry[0] if entry is not None else np.empty(0)
+
     def detectGaps(self, size, stations, inTime):
         print(f"# Gaps > {size} minutes:")
         t_lower, t_upper = inTime
 
         for stn in stations:
-            events = tt.TimeTableParser.eventsByStationMap.get(stn, [])
-            if not events:
-                print(f"{stn}: 0")
-                continue
-
-            # collect only times inside the given range
-            times = [e.atTime for e in events if t_lower <= e.atTime <= t_upper]
+            allTimes = self._station_times(stn)
+            # slice out the times inside the given range
+            lo = np.searchsorted(allTimes, t_lower, side='left')
+            hi = np.searchsorted(allTimes, t_upper, side='right')
+            times = allTimes[lo:hi]
 
-            if not times:
+            if not times.size:
                 print(f"{stn}: 0")
                 continue
 
-            times.sort()
-
-            gapCount = 0
-            for i in range(1, len(times)):
-                if (times[i] - times[i-1]) > size:
-                    gapCount += 1
+            gapCount = int(np.count_nonzero(np.diff(times) > size))
 
             print(f"{stn}: {gapCount}")
 
 
     def applyStationFilters(self, qq):
         t_lower, t_upper = qq.inTimePeriod
-        for rc in self.parser.wtt.rakecycles:
+        wtt = self.parser.wtt
+        for rc in wtt.rakecycles:
             rc.render = True
 
-        for svc in self.parser.wtt.suburbanServices:
-            svc.render = True
+        # event flags for every service in one pass;
+        # NaN (unparsed) times compare False and are hidden
+        np.logical_and(wtt.eventTimes >= t_lower, wtt.eventTimes <= t_upper, out=wtt.eventRender)
 
-            # FIX: Check if events exist before accessing
-            if not svc.events:
-                svc.render = False
-                continue
-
-            for ev in svc.events:
-                ev.render = True
-                
-                # FIX: Check if atTime exists
-                if ev.atTime is None:
-                    ev.render = False
-                    continue
-                    
-                t = ev.atTime
-                if not (t_lower <= t <= t_upper):
-                    ev.render = False
-            
-            svc.checkACConstraint(qq)
+        # services with events that pass the AC filter
+        keep = wtt.applyACMask(wtt.serviceHasEvents.copy(), qq)
+        for svc, k in zip(wtt.suburbanServices, keep.tolist()):
+            svc.render = k
 
-        
 
     def applyServiceFilters(self, qq):
         '''
@@ -1384,72 +1439,59 @@ class Simulator:
         Sets the 'render' flag on each Service object.
         Also updates the parent RakeCycle 'render' flag.
         '''
-        for svc in self.parser.wtt.suburbanServices:
-            svc.render = True
+        # Also reset event render flags
+        wtt = self.parser.wtt
+        wtt.eventRender[:] = True
 
-            if not svc.events: # invalid
-                svc.render = False
-                continue
-            # Also reset event render flags
-            for ev in svc.events:
-                ev.render = True
-
-            # check if the service satisfies the 
-            # start and end station constraint
-            svc.checkDirectionConstraint(qq)
-            svc.checkACConstraint(qq)
-            svc.checkStartStationConstraint(qq)
-            svc.checkEndStationConstraint(qq)
-            svc.checkPassingThroughConstraint(qq)
-            print(f"constraint checks done for {svc}")
-        # print("all services constraint checks done")
-        
-        for rc in self.parser.wtt.rakecycles:
+        # check if the service satisfies the direction, AC,
+        # start/end station and passing through constraints
+        mask = wtt.serviceFilterMask(qq)
+
+        # one pass sets each service's flag and lights up its rake cycle
+        for rc in wtt.rakecycles:
             rc.render = False
-            if rc.servicePath:
-                if any(svc.render for svc in rc.servicePath):
-                    rc.render = True
-        
-        visible_services = len([s for s in self.parser.wtt.suburbanServices if s.render])
-        visible_cycles = len([r for r in self.parser.wtt.rakecycles if r.render])
-        # print(f"Visible services after filter: {visible_services}")
-        # print(f"Visible rake cycles after filter: {visible_cycles}")
+        for svc, keep in zip(wtt.suburbanServices, mask.tolist()):
+            svc.render = keep
+            if keep and svc.rakeCycle is not None:
+                svc.rakeCycle.render = True
+        # print("all services constraint checks done")
 
-    def exportXlsx(self):
+    def exportXlsx(self, out):
         """
-        Generates a Pandas DataFrame containing the filtered services with 
-        columns for Direction, Line, Service ID, Stations, and Timings.
+        Writes an .xlsx of the filtered services to the binary stream out,
+        with columns for Direction, Line, Service ID, Stations, and Timings.
+        Rows go through a write-only openpyxl workbook, so no DataFrame or
+        full in-memory sheet is built.
         """
-        rows = []
+        from openpyxl import Workbook
+
+        wb = Workbook(write_only=True)
+        ws = wb.create_sheet()
+        ws.append(["Service ID", "Start Time", "Source", "Destination", "Direction", "Line"])
         
         # Collect services based on the current filter/render state
         # Usually, self.parser.wtt.suburbanServices contains all services
-        for svc in self.parser.wtt.suburbanServices:
+        wtt = self.parser.wtt
+        # Departure is the first event; serviceFirstTime is NaN without one
+        dep_times = fmt_times(wtt.serviceFirstTime)
+        for svc, dep_time in zip(wtt.suburbanServices, dep_times):
             if not getattr(svc, 'render', True):
                 continue
-                
-            # Formatting Departure and Arrival
-            # Departure is the first event, Arrival is the last event
-            dep_time = "--:--"
-            arr_time = "--:--"
-            if svc.events:
-                dep_time = fmt_time(svc.events[0].atTime)
-                arr_time = fmt_time(svc.events[-1].atTime)
 
             # Determine Line (Fast/Slow)
             # Typically Line.THROUGH is Fast and Line.LOCAL is Slow
             line_str = "Fast" if svc.line == tt.Line.THROUGH else "Slow"
 
-            rows.append({
-                "Service ID": ", ".join(str(sid) for sid in svc.serviceId),
-                "Start Time": dep_time,
-                "Source": svc.initStation.name,
-                "Destination": svc.finalStation.name,
-                "Direction": svc.direction.name,   # UP or DOWN
-                "Line": line_str,                  # Fast or Slow
-            })
+            ws.append([
+                svc.serviceIdStr.replace(",", ", "),           # Service ID
+                dep_time,                                      # Start Time
+                svc.initStation.name,                          # Source
+                svc.finalStation.name,                         # Destination
+                svc.direction.name,                            # UP or DOWN
+                line_str,                                      # Fast or Slow
+            ])
 
-        return pd.DataFrame(rows)
+        wb.save(out)
             
     def exportResults(self):
             buffer = io.StringIO() # Use StringIO to capture print output
@@ -1505,52 +1547,42 @@ class Simulator:
                 if self.query.passingThrough:
                     buffer.write("\n=== Passing Through Times (Grouped by Station, Sorted by Time) ===\n")
 
-                    pt_stations = [s.upper() for s in self.query.passingThrough]
+                    # ordered for printing, each station once
+                    pt_stations = list(dict.fromkeys(s.upper() for s in self.query.passingThrough))
+                    wtt = self.parser.wtt
 
                     # Filter services passing all constraints
-                    rendered_services = [
-                        svc for svc in self.parser.wtt.suburbanServices
-                        if getattr(svc, "render", False)
-                    ]
+                    services = wtt.suburbanServices
+                    rendered = np.fromiter((getattr(svc, "render", False) for svc in services),
+                                           dtype=bool, count=len(services))
+                    rendered_idx = np.flatnonzero(rendered)
 
-                    if not rendered_services:
+                    if not len(rendered_idx):
                         buffer.write("  No services matched the filter criteria.\n\n")
                     else:
-                        # Build: station list of (serviceId, time_minutes, time_str)
-                        st_table = {st: [] for st in pt_stations}
-
-                        for svc in rendered_services:
-                            sid = svc.serviceId[0]
-
-                            # Map events for this service
-                            st_times = {}
-                            for ev in svc.events:
-                                if not getattr(ev, "render", True):
-                                    continue
-                                st = ev.atStation.upper()
-                                st_times.setdefault(st, []).append(ev.atTime)
-
-                            # Fill table
-                            for st in pt_stations:
-                                if st in st_times:
-                                    t = st_times[st][-1]   # last occurrence as you defined
-                                    hh = int(t // 60)
-                                    mm = int(t % 60)
-                                    time_str = f"{hh:02d}:{mm:02d}"
-                                    st_table[st].append((sid, t, time_str))
-                                else:
-                                    # No pass — push with None time so it sorts last
-                                    st_table[st].append((sid, None, "---"))
-
-                        # Sort each station’s list by time (None goes last)
-                        for st in pt_stations:
-                            st_table[st].sort(key=lambda x: (x[1] is None, x[1]))
-
-                        # Print nicely
-                        for st in pt_stations:
+                        sids = [services[i].serviceId[0] for i in rendered_idx.tolist()]
+
+                        # (stations x rendered services) time of each last rendered
+                        # visit (as defined); NaN where the service does not pass
+                        times = np.full((len(pt_stations), len(rendered_idx)), np.nan)
+                        for k, st in enumerate(pt_stations):
+                            last = wtt.lastStationVisit(st, wtt.eventRender)[rendered_idx]
+                            times[k, last >= 0] = wtt.eventTimes[last[last >= 0]]
+
+                        # one sort for every station row: by time, no pass (NaN)
+                        # last, ties keep service order; labels formatted in one
+                        # batch, floored as the report always was (07:59.6 -> 07:59)
+                        order = np.argsort(times, axis=1, kind="stable")
+                        labels = fmt_times(np.take_along_axis(times, order, axis=1).ravel(), floor=True)
+                        n = len(rendered_idx)
+
+                        for k, st in enumerate(pt_stations):
                             buffer.write(f"\n=== {st} ===\n")
-                            for sid, t, time_str in st_table[st]:
-                                buffer.write(f"   {sid:<8} {time_str}\n")
+                            row_labels = labels[k * n:(k + 1) * n]
+                            for i, time_str in zip(order[k].tolist(), row_labels):
+                                if time_str == "--:--":
+                                    time_str = "---"
+                                buffer.write(f"   {sids[i]:<8} {time_str}\n")
 
                         buffer.write("\n")
 
@@ -1559,20 +1591,23 @@ class Simulator:
     def generateSummaryStatus(self):
         wtt = self.parser.wtt
 
-        # compute stats
-        rcs = [rc for rc in wtt.rakecycles if rc.render]
-
-        # total services
+        # compute stats in one pass over the rendered links:
+        # service totals, and the links with a known length
+        total_rendered_links = 0
         total_services=0
         ac_services=0
-        for rc in rcs:
-            total_services += len(rc.servicePath)
-            for svc in rc.servicePath:
+        valid_rcs = []
+        for rc in wtt.rakecycles:
+            if not rc.render:
+                continue
+            total_rendered_links += 1
+            path = rc.servicePath
+            total_services += len(path)
+            for svc in path:
                 if svc.needsACRake and svc.render:
                     ac_services+=1
-                    # print(f"Needs AC: {svc.serviceId}")
-                # else:
-                #     print(f"Non AC: {svc.serviceId}")
+            if rc.lengthKm > 0:
+                valid_rcs.append(rc)
 
         total_parsed_services = len(wtt.suburbanServices) 
         non_ac_services = total_services - ac_services 
@@ -1581,15 +1616,9 @@ class Simulator:
         total_parsed_links = len(wtt.rakecycles)
         parsing_conflicts = len(wtt.conflictingLinks)
 
-        total_rendered_links = len(rcs)
-        valid_rcs = [rc for rc in rcs if rc.lengthKm > 0]
-        shortest_rcs = sorted(valid_rcs, key=lambda rc:rc.lengthKm)[:3]
-        longest_rcs = sorted(valid_rcs, key=lambda rc: rc.lengthKm, reverse=True)[:3]
-
         # contents
-        svcs = [s for s in wtt.suburbanServices if s.render]
         if self.query.type == FilterType.SERVICE:
-            total_services = len(svcs)
+            total_services = sum(1 for s in wtt.suburbanServices if s.render)
             non_ac_services = total_services - ac_services
 
         service_items = [
@@ -1605,14 +1634,22 @@ class Simulator:
             f"Rendered Links: {total_rendered_links}",
         ]
 
-        rake_footer = html.Div([
-            html.Small("Shortest: " + ", ".join(f"{rc.linkName} ({rc.lengthKm:.1f} km)" for rc in shortest_rcs)),
-            html.Br(),
-            html.Small("Longest: " + ", ".join(f"{rc.linkName} ({rc.lengthKm:.1f} km)" for rc in longest_rcs)),
-        ])
+        # shortest/longest links, only when there is something to rank
+        if valid_rcs:
+            byLength = attrgetter('lengthKm')
+            shortest_rcs = nsmallest(3, valid_rcs, key=byLength)
+            longest_rcs = nlargest(3, valid_rcs, key=byLength)
+            rake_footer = html.Div([
+                html.Small("Shortest: " + ", ".join(map(_link_length_text, shortest_rcs))),
+                html.Br(),
+                html.Small("Longest: " + ", ".join(map(_link_length_text, longest_rcs))),
+            ])
+        else:
+            rake_footer = html.Small("No valid links")
 
-        service_card = self.make_summary_card("Service Summary", service_items)
-        rake_card = self.make_summary_card("Rake Link Summary", rake_items, footer=rake_footer)
+        # make_summary_card is the ui.py helper, not a method
+        service_card = make_summary_card("Service Summary", service_items)
+        rake_card = make_summary_card("Rake Link Summary", rake_items, footer=rake_footer)
 
         #htnl 
         summary_layout = dbc.Row(
@@ -1636,111 +1673,61 @@ class Simulator:
         )
 
             
-    def applyTerminalStationFilters(self, start, end):
-        print(f"Applying filters: start={start}, end={end}")
-
-        for rc in self.parser.wtt.rakecycles:
-            rc.render = True  # reset all first
-            if not rc.servicePath:
-                rc.render = False
-                continue
-
-            first = rc.servicePath[0].events[0].atStation
-            last = rc.servicePath[-1].events[-1].atStation
-            # print(f"is {end} == {last}")
-
-            if start and start.upper() != first:
-                rc.render = rc.render and False
-            if end and end.upper() != last:
-                rc.render = rc.render and False
-            # else:
-            #     print(f"Match! {rc.linkName}")
-    
-    def applyPassingThroughFilter(self, qq):
-        '''Make rakecycles visible that have events at every station in passingThru within the specified timeperiod'''
-        selected = qq.passingThrough
-        print(qq.passingThrough)
-        if not selected:
-            return
-        
-        selected = [s.upper() for s in selected]
-        t_start, t_end = qq.inTimePeriod if qq.inTimePeriod else (None, None)
-
-        for rc in self.parser.wtt.rakecycles:
-            rc.render = rc.render and True
-            if not rc.servicePath:
-                rc.render = rc.render and False
-                continue
-
-            # flatten all events in this rakecycle
-            el = []
-            for s in rc.servicePath:
-                el.extend(s.events)
-
-            # filter by time
-            if qq.inTimePeriod:
-                filtered = []
-                for e in el:
-                    if not e.atTime:
-                        continue
-
-                    minutes = e.atTime
-
-                    if t_start <= minutes <= t_end:
-                        filtered.append(e)
-                el = filtered  # keep only events inside window
-
-            # station membership check
-            seen = set()
-            for e in el:
-                if not e.atStation:
-                    continue
-                stName = str(e.atStation).strip().upper()
-                if stName in selected:
-                    seen.add(stName)
-                if len(seen) == len(selected):
-                    break
-
-            if len(seen) < len(selected):
-                rc.render = False
-
-    def applyACFilter(self, qq):
-        '''Render only AC / Non-AC / All rake cycles as per filter.'''
-        mode = qq.ac
-        if mode is None or mode == "all":
-            return  # no filtering
+    def applyLinkFilters(self, qq):
+        '''Filter rake cycles on the AC, start/end station and passing-through
+        constraints in one pass, cheapest check first.'''
+        logger.debug("Applying filters: start=%s, end=%s, passing through: %s",
+                     qq.startStation, qq.endStation, qq.passingThrough)
+        wtt = self.parser.wtt
 
-        for rc in self.parser.wtt.rakecycles:
-            # rc.render = True
-            if not rc.rake:
+        # normalize the query once, not per rake cycle
+        ac = qq.ac if qq.ac in ("ac", "nonac") else None
+        start = qq.startStation.upper() if qq.startStation else None
+        end = qq.endStation.upper() if qq.endStation else None
+        selected = qq.passingThroughSet
+        if selected:
+            # per service: visits each selected station inside the window
+            t_start, t_end = qq.inTimePeriod if qq.inTimePeriod else (None, None)
+            visits = wtt.stationVisits(tuple(selected), t_start, t_end)
+
+        for rc in wtt.rakecycles:
+            path = rc.servicePath
+            if not path:
                 rc.render = False
-                continue
-
-            if mode == "ac" and not rc.rake.isAC:
+            # Render only AC / Non-AC / All rake cycles
+            elif ac is not None and (not rc.rake or bool(rc.rake.isAC) != (ac == "ac")):
                 rc.render = False
-            elif mode == "nonac" and rc.rake.isAC:
+            # terminal stations of the link
+            elif ((start is not None and path[0].events[0].atStation != start)
+                  or (end is not None and path[-1].events[-1].atStation != end)):
                 rc.render = False
+            # every selected station must be visited by some service of the link
+            elif selected:
+                rows = [svc.columnIndex for svc in path]
+                rc.render = bool(visits[rows].any(axis=0).all())
+            else:
+                rc.render = True
 
-    def applyLinkFilters(self, qq):
-        '''Filter rake cycles based on selected start and end stations.'''
-
-        self.applyTerminalStationFilters(qq.startStation, qq.endStation)
-        self.applyPassingThroughFilter(qq)
-        self.applyACFilter(qq)
-
-        visible_count = len([r for r in self.parser.wtt.rakecycles if r.render])
-        print(f"Visible rake cycles after filter: {visible_count}")
+        if logger.isEnabledFor(logging.DEBUG):
+            visible_count = sum(1 for r in self.parser.wtt.rakecycles if r.render)
+            logger.debug("Visible rake cycles after filter: %d", visible_count)
 
     def visualizeLinks3D(self):
+        import plotly.graph_objs as go
+
         rakecycles = [rc for rc in self.parser.wtt.rakecycles if rc.servicePath]
-        print(f"We have  len {len(rakecycles)}")
+        logger.debug("We have %d rakecycles to draw", len(rakecycles))
         if not rakecycles:
             raise ValueError("No valid rakecycles found.")
 
-        distanceMap = tt.TimeTableParser.distanceMap
-        stationToY = {st.upper(): distanceMap[st.upper()] for st in distanceMap}
+        stationToY = tt.TimeTableParser.stationToY
 
+        # Scatter3d is already drawn by plotly.js through WebGL (gl3d), there is
+        # no SVG path to swap out. Traces are kept one per link/service rather
+        # than batched into a few None-separated traces, since clicks, table
+        # selection and AC conversion all address traces by link.
         all_traces = []
+        trace_keys = []
         z_labels = []
         z_offset = 0
 
@@ -1752,89 +1739,67 @@ class Simulator:
             if is_service_filter:
             # Don't check rc.render here - we only care about individual services
                 for svc in rc.servicePath:
-                    # Skip services that don't pass the filter
-                    if not svc.render:
+                    # Skip services that don't pass the filter, or have nothing to draw
+                    if not svc.render or not svc.events:
                         continue
 
+                    # per-service invariants, looked up once
+                    if svc.needsACRake:
+                        color_bright, color_dim = _AC_COLOR, _AC_COLOR_DIM
+                    else:
+                        color_bright, color_dim = _NONAC_COLOR, _NONAC_COLOR_DIM
+                    # Format service IDs for display (handle list of IDs)
+                    svc_id_str = svc.serviceIdStr or '?'
+                    trace_name = f"{rc.linkName}-{svc_id_str}"
+
                     # Build points for this single service
                     # Separate lists for in-range vs out-of-range events
-                    x_in, y_in, z_in, labels_in = [], [], [], []
                     x_out, y_out, z_out, labels_out = [], [], [], []
-                    
-                    for ev in svc.events:
-                        # if not ev.atTime or not ev.atStation:
-                        #     continue
 
-                        minutes = ev.atTime
-
-                        stName = str(ev.atStation).strip().upper()
-                        if stName not in stationToY:
-                            continue
-
-                        # # Check if event is within the filtered time range
-                        # ev_render = getattr(ev, 'render', True)
-                        
-                        # if ev_render:
-                        # Event is in the time filter range
-                        x_in.append(minutes)
-                        y_in.append(stationToY[stName])
-                        z_in.append(z_offset)
-                        labels_in.append(stName)
-                        # else:
-                        #     # Event is outside the time filter range
-                        #     x_out.append(minutes)
-                        #     y_out.append(stationToY[stName])
-                        #     z_out.append(z_offset)
-                        #     labels_out.append(stName)
+                    # events whose station is on the distance map (y resolved at parse),
+                    # sliced straight out of the service's event arrays
+                    keep = np.flatnonzero(~np.isnan(svc.eventY))
+                    x_in = svc.eventTimes[keep]
+                    y_in = svc.eventY[keep]
+                    z_in = np.full(len(keep), z_offset)
+                    labels_in = svc.eventStations[keep]
 
-                    # Format service IDs for display (handle list of IDs)
-                    svc_id_str = ','.join(str(sid) for sid in svc.serviceId) if svc.serviceId else '?'
-                    
                     # Create trace for OUT-OF-RANGE events (dimmed, background context)
                     if x_out:
-                        color_dim = "rgba(66,133,244,0.6)" if svc.needsACRake else "rgba(90,90,90,0.6)"
-                        
                         all_traces.append(
                             go.Scatter3d(
                                 x=x_out, y=y_out, z=z_out,
                                 mode="lines+markers",
                                 line=dict(color=color_dim),
                                 marker=dict(size=2, color=color_dim),
-                                hovertext=[
-                                    f"{svc_id_str}: {st} @ {(int(xx)//60) % 24:02d}:{int(xx%60):02d} (outside filter)"
-                                    for xx, st in zip(x_out, labels_out)
-                                ],
-                                hoverinfo="text",
-                                name=f"{rc.linkName}-{svc_id_str} (context)",
+                                customdata=_hover_data(labels_out, x_out),
+                                hovertemplate=f"{svc_id_str}: %{{customdata[0]}} @ %{{customdata[1]}} (outside filter)<extra></extra>",
+                                name=f"{trace_name} (context)",
                                 showlegend=False,  # Don't clutter legend with dimmed traces
                                 visible=True,
                             )
                         )
+                        trace_keys.append((rc.linkName, None))
                     
                     # Create trace for IN-RANGE events (prominent, filtered results)
-                    # color = "rgba(66,133,244,0.8)" if svc.needsACRake else "rgba(90,90,90,0.8)"
-                    if x_in:
-                        color_bright = "rgba(66,133,244,0.8)" if svc.needsACRake else "rgba(90,90,90,0.8)"
-                        
+                    if len(x_in):
                         all_traces.append(
                             go.Scatter3d(
                                 x=x_in, y=y_in, z=z_in,
                                 mode="lines+markers",
                                 line=dict(color=color_bright),
                                 marker=dict(size=2, color=color_bright),  # Larger markers
-                                hovertext=[
-                                    f"{svc_id_str}: {st} @ {(int(xx)//60) % 24:02d}:{int(xx%60):02d}"
-                                    for xx, st in zip(x_in, labels_in)
-                                ],
-                                hoverinfo="text",
-                                name=f"{rc.linkName}-{svc_id_str}",
+                                customdata=_hover_data(labels_in, x_in),
+                                hovertemplate=f"{svc_id_str}: %{{customdata[0]}} @ %{{customdata[1]}}<extra></extra>",
+                                name=trace_name,
                                 visible=True,
                             )
                         )
-                        z_labels.append((z_offset, f"{rc.linkName}-{svc_id_str}"))
+                        trace_keys.append((rc.linkName, svc_id_str))
+                        z_labels.append((z_offset, trace_name))
                     
                     # Only increment z if we rendered something
-                    if x_in or x_out:
+                    if len(x_in) or x_out:
                         z_offset += 40  # increment z for next service
 
             # RAKELINK mode
@@ -1849,34 +1814,27 @@ class Simulator:
                     mode = "lines+markers"
                 
                 # Aggregate all services in the rake cycle into a single trace
-                x, y, z, stationLabels = [], [], [], []
+                xs, ys, stationLabels = [], [], []
 
                 for svc in rc.servicePath:
                     if not svc.render:
                         continue
-                    # In rake link mode, we render all services in a visible rake cycle
-                    for ev in svc.events:
-                        if not ev.atTime or not ev.atStation:
-                            continue
-
-                        if not ev.render:
-                            continue
-                            
-                        minutes = ev.atTime
-                        # print(minutes)
-
-                        stName = str(ev.atStation).strip().upper()
-                        if stName not in stationToY:
-                            continue
-
-                        x.append(minutes)
-                        y.append(stationToY[stName])
-                        z.append(z_offset)
-                        stationLabels.append(stName)
+                    # In rake link mode, we render all services in a visible rake cycle:
+                    # rendered, timed events at stations on the distance map
+                    keep = np.flatnonzero(svc.eventRender
+                                          & ~np.isnan(svc.eventTimes)
+                                          & ~np.isnan(svc.eventY))
+                    xs.append(svc.eventTimes[keep])
+                    ys.append(svc.eventY[keep])
+                    stationLabels.append(svc.eventStations[keep])
                 
                 # Create single trace for entire rake cycle
-                if x:
-                    color = "rgba(66,133,244,0.8)" if rc.rake.isAC else "rgba(90,90,90,0.8)"
+                x = np.concatenate(xs) if xs else np.empty(0)
+                if len(x):
+                    y = np.concatenate(ys)
+                    stations = np.concatenate(stationLabels)
+                    z = np.full(len(x), z_offset)
+                    color = _AC_COLOR if rc.rake.isAC else _NONAC_COLOR
                     
                     all_traces.append(
                         go.Scatter3d(
@@ -1884,17 +1842,13 @@ class Simulator:
                             mode=mode,
                             line=dict(color=color),
                             marker=dict(size=2, color=color),
-                            # customdata=[{"link": rc.linkName} for _ in x],
-                            hovertext=[
-                                f"{rc.linkName}: {st} @ {(int(xx)//60) % 24:02d}:{int(xx%60):02d}"
-                                for xx, st in zip(x, stationLabels)
-                            ],
-
-                            hoverinfo="text",
+                            customdata=_hover_data(stations, x),
+                            hovertemplate=f"{rc.linkName}: %{{customdata[0]}} @ %{{customdata[1]}}<extra></extra>",
                             name=rc.linkName,
                             visible=True,
                         )
                     )
+                    trace_keys.append((rc.linkName, None))
                     z_labels.append((z_offset, rc.linkName))
                     z_offset += 40  # increment z for next rakecycle
         
@@ -1909,12 +1863,13 @@ class Simulator:
         # x_start = max(0, x_start - padding)
 
         tickPositions = list(range(x_start, x_end + 1, 120))
-        tickLabels = [f"{(t // 60) % 24:02d}:{int(t % 60):02d}" for t in tickPositions]
+        tickLabels = _clock_labels(tickPositions)
 
         yTickVals = list(stationToY.values())
         yTickText = list(stationToY.keys())
 
         fig = go.Figure(data=all_traces)
+        self._traceKeys = trace_keys
 
         fig.update_layout(
             font=dict(size=12, color="#CCCCCC"),
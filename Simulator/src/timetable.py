@@ -7,11 +7,13 @@
 # We want to plot the entire journey in a single day, and in particular, 
 # during the peak hour
 import pandas as pd
+import numpy as np
 import re
 from collections import defaultdict
 import logging
-from datetime import datetime
 import time
+import pickle
+from pathlib import Path
 
 logging.basicConfig(
     level=logging.DEBUG,
@@ -29,6 +31,52 @@ logger = logging.getLogger(__name__)
 
 SERVICE_ID_LEN = 5
 
+# parsed sheet DataFrames, pickled per upload digest for warm restarts
+SHEET_CACHE_DIR = Path(__file__).resolve().parent / ".cache"
+# pickles kept on disk; the least recently used are pruned on write
+SHEET_CACHE_MAX_ENTRIES = 8
+
+def loadCachedSheets(key):
+    '''Return the sheet list pickled under key, or None on a miss.'''
+    if not key:
+        return None
+    path = SHEET_CACHE_DIR / f"{key}.pkl"
+    try:
+        with path.open("rb") as f:
+            sheets = pickle.load(f)
+    except FileNotFoundError:
+        return None
+    except Exception as e:
+        logger.warning(f"Ignoring unreadable sheet cache {path.name}: {e}")
+        return None
+    try:
+        path.touch() # mtime tracks last use, see pruneCachedSheets
+    except OSError:
+        pass
+    return sheets
+
+def storeCachedSheets(key, sheets):
+    '''Pickle the parsed sheets under key; failures only cost the cache.'''
+    if not key:
+        return
+    try:
+        SHEET_CACHE_DIR.mkdir(exist_ok=True)
+        with (SHEET_CACHE_DIR / f"{key}.pkl").open("wb") as f:
+            pickle.dump(sheets, f, protocol=5)
+    except OSError as e:
+        logger.warning(f"Could not write sheet cache: {e}")
+        return
+    pruneCachedSheets()
+
+def pruneCachedSheets(maxEntries=SHEET_CACHE_MAX_ENTRIES):
+    '''Delete all but the maxEntries most recently used sheet pickles.'''
+    try:
+        entries = sorted(SHEET_CACHE_DIR.glob("*.pkl"), key=lambda p: p.stat().st_mtime, reverse=True)
+        for path in entries[maxEntries:]:
+            path.unlink(missing_ok=True)
+    except OSError as e:
+        logger.warning(f"Could not prune sheet cache: {e}")
+
 
 
 class TimeTable:
@@ -51,8 +99,17 @@ class TimeTable:
         # wont that reuire another parse of the serviceCols?
         # isnt it better for the service itself to contain station events?
         self.rakecycles = [] # needs timing info
+        self.rakecyclesByLink = {} # linkName: <RakeCycle>, see indexRakeCycles
         self.allCyclesWtt = [] # from wtt linked follow
+        self._allServicesBySid = {} # str(sid): <Service>, see generateRakeCycles
+        self._linkedToSet = set() # str(linkedTo) of every linked service
         self.conflictingLinks = []
+
+        # flat per-event arrays, see buildEventArrays
+        self.eventRender = None
+        self.eventTimes = None
+        self.eventY = None
+        self.eventStations = None
     
     # def generateRakeCyclePath(self, rakecycle):
     #     # Rakecycle contains the serviceIDs of a rake-link.
@@ -84,6 +141,25 @@ class TimeTable:
                     key = f"svc_{svc.serviceId[0]}"
                     if key in self.originalACStates:
                         svc.needsACRake = self.originalACStates[key]
+        self.updateACServiceCounts()
+
+    def indexRakeCycles(self):
+        '''Rebuild rakecyclesByLink and each service's rakeLinkName/rakeCycle
+        back-pointer; call after rakecycles is filled or pruned.'''
+        self.rakecyclesByLink = {rc.linkName: rc for rc in self.rakecycles}
+        # services of pruned links must not point at a dropped cycle
+        for svc in self.suburbanServices or ():
+            svc.rakeLinkName = None
+            svc.rakeCycle = None
+        for rc in self.rakecycles:
+            for svc in rc.servicePath or ():
+                svc.rakeLinkName = rc.linkName
+                svc.rakeCycle = rc
+
+    def updateACServiceCounts(self):
+        '''Refresh rc.acServiceCount; call after any needsACRake change.'''
+        for rc in self.rakecycles:
+            rc.acServiceCount = sum(svc.needsACRake for svc in rc.servicePath or ())
 
 
     # We have a digraph, with nodes v repreented by 
@@ -95,7 +171,7 @@ class TimeTable:
     # - No cycles in CCs
     def makeRakeCyclePathsSV(self, services):
         '''
-        Build rake-cycle paths by recursively following directed `linkedTo` chains.
+        Build rake-cycle paths by iteratively following directed `linkedTo` chains.
         Each service node stores both `prev` and `next` links.
         '''
         idMap = {sid: s for s in services for sid in s.serviceId}
@@ -140,15 +216,6 @@ class TimeTable:
 
         visited = set()
 
-        def followChain(sid, chain):
-            if sid in visited or sid not in idMap:
-                return
-            visited.add(sid)
-            chain.append(idMap[sid])
-            nxt = adj[sid]['next']
-            if nxt:
-                followChain(nxt, chain)
-
         # We need to find chains - i.e. 
         # series of services that have no prev node
         # in the adjacency list.
@@ -177,7 +244,11 @@ class TimeTable:
             # sid is a starting node.
             # now we follow its links
             chain = []
-            followChain(sid, chain)
+            cur = sid
+            while cur and cur not in visited and cur in idMap:
+                visited.add(cur)
+                chain.append(idMap[cur])
+                cur = adj[cur]['next']
             if chain:
                 # # print(chain[0])
                 self.allCyclesWtt.append(chain)
@@ -203,20 +274,14 @@ class TimeTable:
         # undefined by mentioned in syummary are ignored.
         # "For a given rc in the set of rakecycles created on the set of defined services, 
         # are there any services that are not defined"
-        allServices = {str(s.serviceId[0]): s for s in self.suburbanServices}
-        s = allServices.get(str(sid)) 
+        s = self._allServicesBySid.get(str(sid))
         assert(s) # due to the suburbanservices creation step earlier
 
-        if any(str(sid) == str(sv.linkedTo) for sv in allServices.values()):
+        if str(sid) in self._linkedToSet:
             logger.debug(f"Service {sid} appears as a linkedTo of another service in WTT. Possible mislink in rakecycle {linkName}.")
             logger.info("Treat summary as source of truth. Reconstruct path using the serviceIds in the summary")
-            path = []
-            # # print(rc.serviceIds)
-            for id in rc.serviceIds:
-                # # print(f"aha {id}")
-                svc = allServices.get(str(id)) 
-                assert(svc)
-                path.append(svc)
+            path = [self._allServicesBySid.get(str(id)) for id in rc.serviceIds]
+            assert(all(path))
             # logger.debug(path)
             return path
 
@@ -231,6 +296,10 @@ class TimeTable:
         # for sv in self.suburbanServices:
             # print(sv)
 
+        # lookups for fixPath, built once rather than per invalid link
+        self._allServicesBySid = {str(sv.serviceId[0]): sv for sv in self.suburbanServices}
+        self._linkedToSet = {str(sv.linkedTo) for sv in self.suburbanServices if sv.linkedTo}
+
         self.makeRakeCyclePathsSV(self.suburbanServices)
         # print(f"# rake links = {len(self.allCyclesWtt)}")
 
@@ -245,22 +314,15 @@ class TimeTable:
         # rc.servicePath
         # rc.serviceIds contains the service path. [sids]
         # print("linking rake to path")
+        # index paths by their first service id; one hashed lookup per rc
+        pathByFirstSid = {str(p[0].serviceId[0]): p for p in self.allCyclesWtt}
         invalid = []
         for rc in self.rakecycles:
-            # print(rc.serviceIds)
-            # print("---")
-            # print(str(rc.serviceIds[0]))
-            # print("---")
-            for path in self.allCyclesWtt:
-                # print(f"ahaha {str(path[0].serviceId[0])}")
-                if str(rc.serviceIds[0]) == str(path[0].serviceId[0]):
-                    # print(f"adding path of length {len(path)}")
-                    rc.servicePath = path
-                # else:
-                #     logger.debug("Mismatch between wtt and summary init")
-                #     logger.debug(f"summ: {str(rc.serviceIds[0])}, wtt: {str(path[0].serviceId[0])}")
+            path = pathByFirstSid.get(str(rc.serviceIds[0]))
+            if path:
+                rc.servicePath = path
             if not rc.servicePath:
-                logger.debug(f"Link {rc.linkName}: Summ starts with: {str(rc.serviceIds[0])}, wtt starts with: {str(path[0].serviceId[0])}")
+                logger.debug(f"Link {rc.linkName}: Summ starts with: {str(rc.serviceIds[0])}, no wtt path starts there")
                 # print(f"Issue with serviceIdpath: {rc.linkName}") # every rakecycle must be assigned its path by the end.
                 logger.warning(f"Unable to match rakelink {rc.linkName} to a wtt-derived service-path. Fixing...")
                 fixedPath = self.fixPath(rc)
@@ -304,16 +366,207 @@ class TimeTable:
                 svc.initStation = self.stations[svc.events[0].atStation]   
                 svc.finalStation = self.stations[svc.events[-1].atStation]
 
-                # calculate service distance
-                svc.computeLengthKm()
-                rc.lengthKm += svc.lengthKm
-            print(f"Length of {rc.linkName} = {rc.lengthKm} Km")
-
         # assign rakes to rakecycles
         self.assignRakes()
+        self.indexRakeCycles()
+        self.buildEventArrays()
+        self.buildServiceColumns()
+        self.buildStationEventIndex()
+
+        # calculate service and link distances
+        self.computeLengthsKm()
+        for rc in self.rakecycles:
+            rc.lengthKm = sum(svc.lengthKm for svc in rc.servicePath)
+            print(f"Length of {rc.linkName} = {rc.lengthKm} Km")
+
+        self.updateACServiceCounts()
 
         # for rc in self.rakecycles:
         #     self.generateRakeCyclePath(rc) 
+    def buildEventArrays(self):
+        '''
+        Pack the render flag and time of every event of every suburban service
+        into two flat arrays. Each service gets views over its own slice
+        (svc.eventRender, svc.eventTimes), so resetting all flags is a single
+        assignment and per-service writes land in the shared arrays.
+        Always write through the views in place, rebinding them breaks the link.
+        Unparsed times are stored as NaN.
+        eventY (svc.eventY) is the plot y of each event's station, its
+        distanceMap km, resolved once here; NaN for stations not on the map.
+        eventStations (svc.eventStations) holds the station names, so labels
+        can be gathered with the same index arrays as times and y.
+        '''
+        services = self.suburbanServices
+        distanceMap = TimeTableParser.distanceMap
+        self.eventRender = np.ones(sum(len(svc.events) for svc in services), dtype=bool)
+        self.eventTimes = np.array(
+            [np.nan if e.atTime is None else e.atTime for svc in services for e in svc.events],
+            dtype=float
+        )
+        self.eventY = np.array(
+            [distanceMap.get(e.atStation, np.nan) for svc in services for e in svc.events],
+            dtype=float
+        )
+        self.eventStations = np.array(
+            [e.atStation for svc in services for e in svc.events],
+            dtype=object
+        )
+        start = 0
+        for svc in services:
+            end = start + len(svc.events)
+            svc.eventRender = self.eventRender[start:end]
+            svc.eventTimes = self.eventTimes[start:end]
+            svc.eventY = self.eventY[start:end]
+            svc.eventStations = self.eventStations[start:end]
+            start = end
+
+    def buildServiceColumns(self):
+        '''
+        Per-service columns (in suburbanServices order) for vectorised
+        filtering: offsets into the flat event arrays, direction, first/last
+        station and time, plus a station id for every event.
+        '''
+        services = self.suburbanServices
+        n = len(services)
+        counts = np.array([len(svc.events) for svc in services], dtype=np.int64)
+        self.serviceOffsets = np.zeros(n + 1, dtype=np.int64)
+        np.cumsum(counts, out=self.serviceOffsets[1:])
+        self.serviceHasEvents = counts > 0
+        for i, svc in enumerate(services):
+            svc.columnIndex = i
+
+        self.stationIds = {name: i for i, name in enumerate(self.stations)}
+        self.eventStationIds = np.array(
+            [self.stationIds.get(e.atStation, -1) for svc in services for e in svc.events],
+            dtype=np.int64
+        )
+        self.serviceDirection = np.array([svc.direction.name if svc.direction else '' for svc in services])
+
+        has = self.serviceHasEvents
+        firstIdx = self.serviceOffsets[:-1][has]
+        lastIdx = self.serviceOffsets[1:][has] - 1
+        self.serviceFirstStationId = np.full(n, -1, dtype=np.int64)
+        self.serviceLastStationId = np.full(n, -1, dtype=np.int64)
+        self.serviceFirstTime = np.full(n, np.nan)
+        self.serviceLastTime = np.full(n, np.nan)
+        self.serviceFirstStationId[has] = self.eventStationIds[firstIdx]
+        self.serviceLastStationId[has] = self.eventStationIds[lastIdx]
+        self.serviceFirstTime[has] = self.eventTimes[firstIdx]
+        self.serviceLastTime[has] = self.eventTimes[lastIdx]
+
+    def buildStationEventIndex(self):
+        '''
+        For every station in eventsByStationMap, its timed events sorted by
+        atTime next to an ascending array of those times, so a time-window
+        query is two np.searchsorted calls. See utils.getStationEvents.
+        '''
+        index = {}
+        for st, events in TimeTableParser.eventsByStationMap.items():
+            timed = sorted((e for e in events if e.atTime is not None), key=lambda e: e.atTime)
+            index[st] = (np.array([e.atTime for e in timed], dtype=float), timed)
+        TimeTableParser.stationEventIndex = index
+
+    def computeLengthsKm(self):
+        '''
+        svc.lengthKm for every suburban service in one pass over eventY:
+        a running sum of |step| between consecutive events, differenced at
+        each service's first and last event. Steps to an unmapped station
+        (NaN y) count as 0.
+        '''
+        steps = np.nan_to_num(np.abs(np.diff(self.eventY)))
+        runKm = np.concatenate(([0.0], np.cumsum(steps)))
+        has = self.serviceHasEvents
+        lengths = np.zeros(len(self.suburbanServices))
+        lengths[has] = runKm[self.serviceOffsets[1:][has] - 1] - runKm[self.serviceOffsets[:-1][has]]
+        for svc, km in zip(self.suburbanServices, lengths.tolist()):
+            svc.lengthKm = km
+
+    def applyACMask(self, mask, qq):
+        '''
+        AND the AC/non-AC filter of qq into mask (over suburbanServices)
+        in place.
+        '''
+        if qq.ac == "ac" or qq.ac == "nonac":
+            services = self.suburbanServices
+            ac = np.fromiter((svc.needsACRake for svc in services), dtype=bool, count=len(services))
+            mask &= ac if qq.ac == "ac" else ~ac
+        return mask
+
+    def serviceFilterMask(self, qq):
+        '''
+        Boolean mask over suburbanServices of the services passing the
+        Service tab query.
+        '''
+        services = self.suburbanServices
+        t_lower, t_upper = qq.inTimePeriod
+        mask = self.serviceHasEvents.copy()
+
+        def inWindow(times):
+            return (times >= t_lower) & (times <= t_upper) # NaN -> False
+
+        if qq.inDirection:
+            mask &= np.isin(self.serviceDirection, list(qq.inDirection))
+
+        self.applyACMask(mask, qq)
+
+        if qq.startStation:
+            sid = self.stationIds.get(qq.startStation, -2)
+            mask &= (self.serviceFirstStationId == sid) & inWindow(self.serviceFirstTime)
+
+        if qq.endStation:
+            sid = self.stationIds.get(qq.endStation, -2)
+            mask &= (self.serviceLastStationId == sid) & inWindow(self.serviceLastTime)
+
+        if qq.passingThrough and mask.any():
+            # the last visit of each station must fall inside the window;
+            # the (upper-cased) set checks a repeated station once
+            for name in qq.passingThroughSet:
+                last = self.lastStationVisit(name)
+                visited = last >= 0
+                t = np.full(len(services), np.nan)
+                t[visited] = self.eventTimes[last[visited]]
+                mask &= visited & inWindow(t)
+
+        return mask
+
+    def stationVisits(self, names, t_lower=None, t_upper=None):
+        '''
+        (services x names) bool matrix: does the service have an event at
+        each station, timed inside [t_lower, t_upper] when a window is given.
+        One OR-reduction per station over the CSR event segments.
+        '''
+        visits = np.zeros((len(self.suburbanServices), len(names)), dtype=bool)
+        nonempty = np.flatnonzero(self.serviceHasEvents)
+        if not len(nonempty):
+            return visits
+        starts = self.serviceOffsets[nonempty]
+        inWindow = None
+        if t_lower is not None:
+            inWindow = (self.eventTimes >= t_lower) & (self.eventTimes <= t_upper) # NaN -> False
+        for k, name in enumerate(names):
+            hit = self.eventStationIds == self.stationIds.get(name, -2)
+            if inWindow is not None:
+                hit &= inWindow
+            visits[nonempty, k] = np.logical_or.reduceat(hit, starts)
+        return visits
+
+    def lastStationVisit(self, name, eventMask=None):
+        '''
+        Flat event position of each service's last event at station name
+        (only events set in eventMask, if given), -1 where there is none.
+        The max event position per service (CSR segments) finds that visit.
+        '''
+        nonempty = np.flatnonzero(self.serviceHasEvents)
+        starts = self.serviceOffsets[nonempty]
+        hit = self.eventStationIds == self.stationIds.get(name.upper(), -2)
+        if eventMask is not None:
+            hit &= eventMask
+        hits = np.where(hit, np.arange(len(hit)), -1)
+        last = np.full(len(self.suburbanServices), -1, dtype=np.int64)
+        if len(nonempty):
+            last[nonempty] = np.maximum.reduceat(hits, starts)
+        return last
+
     def assignRakes(self):
         for i, rc in enumerate(self.rakecycles):
             rake = Rake(i)
@@ -411,6 +664,7 @@ class RakeCycle:
 
         self.render = True # render each rakecycle
         self.lengthKm = 0 # updated during generatecycles
+        self.acServiceCount = 0 # services in servicePath needing AC
 
     
     def __repr__(self):
@@ -476,10 +730,12 @@ class Service:
         self.type = type # regular, stabling, multi-service
         self.zone = None # western, central
         self.serviceId = None # a list
+        self.serviceIdStr = '' # "93001,93002", for display
         self.direction = None # UP (VR->CCG) or DOWN (CCG to VR)
         self.line = None #Through (fast) or Local (L)
 
         self.rakeLinkName = None
+        self.rakeCycle = None # RakeCycle whose servicePath holds this service
         self.rakeSizeReq = None # 15 is default?, 12 is specified via "12 CAR", but what are blanks?
         self.needsACRake = False
 
@@ -492,6 +748,15 @@ class Service:
         self.finalStation = None
 
         self.events = [] # [StationEvents in chronological order]
+        self.firstEventTime = None # atTime of the first timed event
+        # row of this service in the TimeTable.service* columns
+        self.columnIndex = None
+        # views into TimeTable.eventRender / eventTimes / eventY / eventStations,
+        # one slot per event
+        self.eventRender = None
+        self.eventTimes = None
+        self.eventY = None
+        self.eventStations = None
 
         # by default each service is active each day
         # AC services have a date restriction
@@ -501,111 +766,6 @@ class Service:
         
         # self.name = None
     
-    def checkStartStationConstraint(self, qq):
-        if not qq.startStation:
-            return
-        
-        start = qq.startStation
-        print(self.events)
-        print(self)
-        first = self.events[0].atStation
-
-        t_first = self.events[0].atTime
-        t_lower, t_upper = qq.inTimePeriod # minutes
-        print(first)
-        print(start)
-
-        if first == start:
-            if not (t_lower <= t_first <= t_upper):
-                self.render = self.render and False
-        else:
-            self.render = self.render and False
-        
-    def checkEndStationConstraint(self, qq):
-        if not qq.endStation:
-            return
-        
-        end = qq.endStation
-        last = self.events[-1].atStation
-        t_last = self.events[-1].atTime
-        t_lower, t_upper = qq.inTimePeriod
-
-        if last == end:
-            if not (t_lower <= t_last <= t_upper):
-                self.render = self.render and False
-        else:
-            self.render = self.render and False
-
-    def checkDirectionConstraint(self, qq):
-        dir = qq.inDirection
-        if not dir:
-            return
-        
-        dirMatch = False
-        # print(f"dir: {qq.inDirection}")
-        for d in qq.inDirection:
-            if d == "UP" and self.direction == Direction.UP:
-                dirMatch = True
-                break
-            elif d == "DOWN" and self.direction == Direction.DOWN:
-                dirMatch = True
-                break
-        
-        if not dirMatch:
-            self.render = self.render and False
-
-    def checkACConstraint(self, qq):
-        mode = qq.ac
-        if not mode or mode == "all":
-            return
-        
-        if mode == "ac" and not self.needsACRake:
-            self.render = self.render and False
-        elif mode == "nonac" and self.needsACRake:
-            self.render = self.render and False
-
-    def checkPassingThroughConstraint(self, qq):
-        qPassingStns = [s.upper() for s in qq.passingThrough] if qq.passingThrough else []
-        if not qPassingStns:
-            return # no filter
-        
-        # map stations in servicepath to times
-        stnMapTimes = {}
-        for e in self.events:
-            if e.atStation not in stnMapTimes:
-                stnMapTimes[e.atStation] = []
-            stnMapTimes[e.atStation].append(e.atTime)
-
-        for st in qPassingStns:
-            # if even one query station is not passed by the
-            # service, return
-            if st not in stnMapTimes:
-                self.render = self.render and False
-                return
-            
-            # this service passes through this query station
-            # check if it occurs in the given time interval
-            t = stnMapTimes[st][-1]
-            t_lower, t_upper = qq.inTimePeriod
-            if not (t_lower <= t <= t_upper):
-                self.render = self.render and False
-                return
-        
-        # if here, the service satisfies the constraint
-        # render it.
-
-    def computeLengthKm(self):
-        l = 0
-        dprev = TimeTableParser.distanceMap[self.events[0].atStation]
-        for e in self.events[1:]:
-            stName = e.atStation
-            dCCGKm = TimeTableParser.distanceMap[stName]
-            d = abs(dprev - dCCGKm)
-            l += d
-            dprev = dCCGKm
-        # assert(l > 0)
-        self.lengthKm = l
-
     def generateStationEvents(self):
         sheet = None
         if self.direction == Direction.UP:
@@ -614,20 +774,24 @@ class Service:
             sheet = TimeTableParser.wttSheets[1]
 
         stName = None
-        serviceCol = self.rawServiceCol
-        # print(serviceCol)
-        for rowIdx, cell in serviceCol.items():
-            match = TimeTableParser.rTimePattern.search(str(cell))
+        # plain arrays: positional indexing without pandas' scalar accessors
+        col = self.rawServiceCol.to_numpy()
+        stCol = sheet.iloc[:, 0].to_numpy()
+        adCol = sheet.iloc[:, 1].to_numpy()
+        timePattern = TimeTableParser.rTimePattern
+        rawEvents = [] # (stName, time, eType), turned into StationEvents after the loop
+        for rowIdx, cell in enumerate(col):
+            match = timePattern.search(str(cell))
             if match:
                 tCell = match.group(0)
-                stName= sheet.iat[rowIdx, 0]
+                stName= stCol[rowIdx]
                 # # print(stName)
                 # this can be made better
                 if pd.isna(stName) or not str(stName).strip():
                     # check row above
-                    stName = sheet.iat[rowIdx - 1, 0]
+                    stName = stCol[rowIdx - 1]
                     if pd.isna(stName) or not str(stName).strip():
-                        stName = sheet.iat[rowIdx - 2, 0]
+                        stName = stCol[rowIdx - 2]
                 # stName = str(self.stationCol.iloc[rowIdx]).strip().upper()
                 if str(stName).strip() == "M'BAI CENTRAL (L)":
                     # hack special case. 
@@ -646,39 +810,35 @@ class Service:
                     # a valid time, not the station above
                     # print("reversal")
                     # check row above
-                    stName= sheet.iat[rowIdx - 1, 0]
+                    stName= stCol[rowIdx - 1]
                     if pd.isna(stName) or not str(stName).strip():
-                        stName = sheet.iat[rowIdx - 2, 0]
+                        stName = stCol[rowIdx - 2]
                     
-                    stName = self.events[-1].atStation
+                    stName = rawEvents[-1][0]
                 
                 stName = stName.strip().upper()
                 
                 # check arrival and departure
                 # at a time cell, is it near an A or D cell.
                 # if so, there is some dwell.
-                # print(sheet.iat[rowIdx, 1])
-                # isDTime = True if sheet.iat[rowIdx, 1] == "D" else False
-                isATime = True if sheet.iat[rowIdx, 1] == "A" else False
+                # print(adCol[rowIdx])
+                # isDTime = True if adCol[rowIdx] == "D" else False
+                isATime = True if adCol[rowIdx] == "A" else False
 
                 # assuming A always before D
                 if isATime:
                     tArr = str(tCell).strip()
-                    e1 = StationEvent(stName, self, tArr, EventType.ARRIVAL)
+                    rawEvents.append((stName, tArr, EventType.ARRIVAL))
                     # assert next time is a D time
-                    isDTime = True if sheet.iat[rowIdx+1, 1] == "D" else False
-                    self.events.append(e1)
-                    TimeTableParser.eventsByStationMap[stName].append(e1)
-                    # # print(sheet.iat[rowIdx+1, 1])
+                    isDTime = True if adCol[rowIdx+1] == "D" else False
+                    # # print(adCol[rowIdx+1])
                     if isDTime:
-                        tDep = str(serviceCol.iloc[rowIdx + 1]).strip()
+                        tDep = str(col[rowIdx + 1]).strip()
                         # print(tDep)
                         # assert tDep is a time
-                        if TimeTableParser.rTimePattern.match(tDep):
+                        if timePattern.match(tDep):
                             # print("boom")
-                            e2 = StationEvent(stName, self, tDep, EventType.DEPARTURE)
-                            self.events.append(e2)
-                            TimeTableParser.eventsByStationMap[stName].append(e2)
+                            rawEvents.append((stName, tDep, EventType.DEPARTURE))
                     else:
                         # probably the last station
                         # nothing to do
@@ -689,16 +849,26 @@ class Service:
                     # we assume the gap between arrival departure is small, 
                     # but arrival time is specified in the wtt.
                     time = str(tCell).strip()
-                    e = StationEvent(stName, self, time, EventType.ARRIVAL)
-                    self.events.append(e)
-                    TimeTableParser.eventsByStationMap[stName].append(e)
+                    rawEvents.append((stName, time, EventType.ARRIVAL))
+
+        events = [StationEvent(st, self, t, eType) for st, t, eType in rawEvents]
+        self.events.extend(events)
+
+        # one shared-map lookup per station rather than per event
+        byStation = defaultdict(list)
+        for e in events:
+            byStation[e.atStation].append(e)
+        for st, evs in byStation.items():
+            TimeTableParser.eventsByStationMap[st].extend(evs)
+
+        self.firstEventTime = next((e.atTime for e in self.events if e.atTime is not None), None)
 
         # print(f"For service {self.serviceId}, events are:")
         # for ev in self.events:
         #     print(f"{ev.atStation}: {ev.atTime}")
                     
     def __repr__(self):
-        sid = ','.join(str(s) for s in self.serviceId) if self.serviceId else 'None'
+        sid = self.serviceIdStr or 'None'
         dirn = self.direction.name if self.direction else 'NA'
         zone = self.zone.name if self.zone else 'NA'
         ac = 'AC' if self.needsACRake else 'NON-AC'
@@ -721,27 +891,33 @@ class EventType(Enum):
 
 class StationEvent:
     def __init__(self, st, sv, time, type):
+        # station name, stripped and upper-cased by the caller
+        # (Service.generateStationEvents) so consumers can compare it as is
         self.atStation = st
         self.ofService = sv
         self.atTime = self._timeToMinutes(time)
 
         self.platform = None
         self.eType = None
-        self.render = True
     
     def _timeToMinutes(self, time_str):
         '''Convert time string to minutes since midnight, with wrap-around.'''
         if not time_str:
             return None
-        try:
-            t = datetime.strptime(time_str.strip(), "%H:%M:%S")
-        except:
-            try:
-                t = datetime.strptime(time_str.strip(), "%H:%M")
-            except:
-                return None
-        
-        minutes = t.hour * 60 + t.minute + t.second / 60
+        # plain arithmetic on "H[H]:M[M][:S[S]]", each field 1-2 ASCII digits
+        # (what the old strptime("%H:%M:%S") / ("%H:%M") pair took), without
+        # the datetimes; int() alone would also take "+5", " 5" and "1_0"
+        h, _, rest = time_str.strip().partition(':')
+        m, sep, sec = rest.partition(':')
+        fields = (h, m, sec) if sep else (h, m)
+        if not all(0 < len(f) <= 2 and f.isascii() and f.isdigit() for f in fields):
+            return None
+        h, m = int(h), int(m)
+        sec = int(sec) if sep else 0
+        if not (h < 24 and m < 60 and sec < 62):
+            return None
+
+        minutes = h * 60 + m + sec / 60
         if minutes < 165:  # 2:45 AM wrap-around
             minutes += 1440
         return minutes
@@ -791,8 +967,12 @@ class TimeTableParser:
         "BORIVALI": 34, "DAHISAR": 37, "MIRA ROAD": 40, "BHAYANDAR": 44,
         "NAIGAON": 48, "VASAI ROAD": 52, "NALLASOPARA": 56, "VIRAR": 60
     }
+    # distanceMap keyed by upper-cased name, built once: plot y of each station
+    stationToY = {st.upper(): km for st, km in distanceMap.items()}
 
     eventsByStationMap = defaultdict(list)
+    # station: (sorted times, events in that order), see buildStationEventIndex
+    stationEventIndex = {}
 
     def __init__(self, fpWttXlsx=None, fpWttSummaryXlsx=None):
         self.wtt = TimeTable()
@@ -836,39 +1016,43 @@ class TimeTableParser:
         instance.wtt.suburbanServices = instance.isolateSuburbanServices()
         return instance
 
-    def xlsxToDfFromFileObj(self, fileObj):
-        '''Parse Excel from file object instead of path'''
-        xlsx = pd.ExcelFile(fileObj)
-        for sheet in xlsx.sheet_names:
-            df = xlsx.parse(sheet, skiprows=4).dropna(axis=1, how='all')
-            TimeTableParser.wttSheets.append(df)
+    def xlsxToDfFromFileObj(self, fileObj, cacheKey=None):
+        '''Parse Excel from file object instead of path.
+        With cacheKey, sheets are read from / written to the sheet cache.'''
+        sheets = loadCachedSheets(cacheKey)
+        if sheets is None:
+            xlsx = pd.ExcelFile(fileObj)
+            sheets = [xlsx.parse(sheet, skiprows=4).dropna(axis=1, how='all')
+                      for sheet in xlsx.sheet_names]
+            storeCachedSheets(cacheKey, sheets)
+        TimeTableParser.wttSheets.extend(sheets)
             
         self.upSheet = TimeTableParser.wttSheets[0]
         self.downSheet = TimeTableParser.wttSheets[1]
 
-    def parseWttSummaryFromFileObj(self, fileObj):
-        '''Parse summary Excel from file object instead of path'''
-        xlsx = pd.ExcelFile(fileObj)
-        summarySheet = xlsx.sheet_names[0]
-        self.wttSummarySheet = xlsx.parse(summarySheet, skiprows=2).dropna(axis=0, how="all")
+    def parseWttSummaryFromFileObj(self, fileObj, cacheKey=None):
+        '''Parse summary Excel from file object instead of path.
+        With cacheKey, the sheet is read from / written to the sheet cache.'''
+        cached = loadCachedSheets(cacheKey)
+        if cached is None:
+            xlsx = pd.ExcelFile(fileObj)
+            summarySheet = xlsx.sheet_names[0]
+            cached = [xlsx.parse(summarySheet, skiprows=2).dropna(axis=0, how="all")]
+            storeCachedSheets(cacheKey, cached)
+        self.wttSummarySheet = cached[0]
         self.parseRakeLinks(self.wttSummarySheet)
     
     def isolateSuburbanServices(self):
         suburbanIds = set()
         # print("Updating suburban")
-        seen, repeated = set(), set()
         for rc in self.wtt.rakecycles:
             # print(rc.serviceIds)
             suburbanIds.update(rc.serviceIds)
-            s = set(rc.serviceIds)
-            repeated |= seen & s
-            seen |= s
-        # print(repeated)
         
-        suburbanServices = []
-        for s in (self.wtt.upServices + self.wtt.downServices):
-            if any(sid in suburbanIds for sid in s.serviceId):
-                suburbanServices.append(s)
+        suburbanServices = [
+            s for s in (self.wtt.upServices + self.wtt.downServices)
+            if not suburbanIds.isdisjoint(s.serviceId)
+        ]
 
         print(f"\nSuburban services identified: {len(suburbanServices)} / {len(self.wtt.upServices) + len(self.wtt.downServices)}")
         return suburbanServices
@@ -876,6 +1060,11 @@ class TimeTableParser:
     # timetable.py -> class TimeTableParser
     def parseRakeLinks(self, sheet):
         allServices = self.wtt.upServices + self.wtt.downServices
+        # str(serviceId) -> first service carrying it
+        servicesById = {}
+        for s in allServices:
+            for sid in s.serviceId:
+                servicesById.setdefault(str(sid), s)
         sheet = sheet.reset_index(drop=True)
 
         for i in range(len(sheet)):
@@ -937,8 +1126,11 @@ class TimeTableParser:
 
             for sid, speed in service_entries:
                 rc.serviceIds.append(sid)
-                # Match with Service objects (casting to string for robust comparison)
-                service = next((s for s in allServices if str(sid) in str(s.serviceId)), None)
+                # Match with Service objects (casting to string for robust comparison);
+                # exact id first, the old substring scan only on a miss
+                service = servicesById.get(str(sid))
+                if service is None:
+                    service = next((s for s in allServices if str(sid) in str(s.serviceId)), None)
                 if service:
                     service.linkName = linkName
                     service.speed = speed # Assign the extracted speed label
@@ -946,6 +1138,7 @@ class TimeTableParser:
                     rc.undefinedIds.append((linkName, sid))
 
             self.wtt.rakecycles.append(rc)
+        self.wtt.indexRakeCycles()
 
         # summary (Logic remains the same as your original)
         if 'rc' in locals() and rc.undefinedIds:
@@ -1361,6 +1554,7 @@ class TimeTableParser:
                 service.type = ServiceType.MULTI_SERVICE # multiple SIDs
 
             service.serviceId = sIds
+            service.serviceIdStr = ','.join(map(str, sIds))
             service.rakeSizeReq = rakeSize
             service.zone = zone
             # service.rakeLinkName = linkName # initially None
@@ -5,14 +5,79 @@
 from dash import Dash, html, dcc, Input, Output, State, callback_context
 from dash import dash_table
 import dash_bootstrap_components as dbc
+import functools
+import numpy as np
+
+# Shared style dicts. Components only hold references to these, never mutate them.
+UPLOAD_STYLE = {
+    "height": "140px",
+    "borderWidth": "2px",
+    "borderStyle": "dashed",
+    "borderRadius": "12px",
+    "borderColor": "#cbd5e1",
+    "display": "flex",
+    "alignItems": "center",
+    "justifyContent": "center",
+    "cursor": "pointer",
+    "transition": "all 0.2s ease",
+}
+# upload box once a file is in
+UPLOAD_SUCCESS_STYLE = {**UPLOAD_STYLE, "borderStyle": "solid", "borderColor": "#188038"}
+UPLOAD_ICON_STYLE = {"width": "28px", "height": "28px", "marginBottom": "6px"}
+UPLOAD_TITLE_STYLE = {"fontWeight": "500", "color": "#334155", "fontSize": "14px"}
+UPLOAD_HINT_STYLE = {"fontSize": "11px", "color": "#94a3b8", "marginTop": "4px"}
+CRITERIA_CARD_STYLE = {"margin": "0px 0px"}
+TABLE_STYLE = {"maxHeight": "260px", "overflowY": "auto", "overflowX": "auto"}
+# fixed column widths: with fixed_rows + virtualization the header and the
+# rendered row window are separate tables, so widths must not depend on content.
+# Per-column widths below are sized for the longest ids / station names;
+# the ellipsis only guards against unexpected values.
+TABLE_CELL_STYLE = {
+    "padding": "6px", "fontSize": "13px",
+    "minWidth": "90px", "width": "90px", "maxWidth": "90px",
+    "overflow": "hidden", "textOverflow": "ellipsis",
+}
+RAKE_TABLE_WIDTHS = {
+    "linkname": 70, "cars": 55, "is_ac": 60, "length_km": 95,
+    "start": 150, "end": 150, "n_services": 70,
+}
+SERVICE_TABLE_WIDTHS = {
+    "service_id": 150, "direction": 85, "is_ac": 60, "cars": 55,
+    "start_station": 150, "end_station": 150, "start_time": 90, "rake_link": 80,
+}
+TABLE_COUNT_STYLE = {"marginBottom": "6px", "fontWeight": "500"}
+
+# "HH:MM" for every minute of the operating day. Times before 02:45 are
+# wrapped past midnight by the parser, so the table runs to 24h + 165 min.
+_TIME_STR = tuple(f"{m//60:02d}:{m%60:02d}" for m in range(1440 + 165 + 1))
+# RangeSlider marks, every two hours
+_TIME_MARKS = {i: _TIME_STR[i] for i in range(0, 1441, 120)}
 
 def fmt_time(t):
     """Format time in minutes to HH:MM string"""
     if t is None:
         return "--:--"
     t = int(round(t))
+    if 0 <= t < len(_TIME_STR):
+        return _TIME_STR[t]
     return f"{t//60:02d}:{t%60:02d}"
 
+# _TIME_STR as an array, with "--:--" appended for missing times
+_TIME_STR_ARR = np.array(_TIME_STR + ("--:--",))
+
+def fmt_times(times, floor=False):
+    """fmt_time over an array of minutes (NaN for missing), as a list;
+    floor=True truncates fractional minutes instead of rounding them"""
+    t = np.asarray(times, dtype=float)
+    t = np.floor(t) if floor else np.rint(t)
+    missing = np.isnan(t)
+    idx = np.where(missing, len(_TIME_STR), t).astype(np.int64)
+    outside = ~missing & ((idx < 0) | (idx >= len(_TIME_STR)))
+    out = _TIME_STR_ARR[np.where(outside, len(_TIME_STR), idx)].tolist()
+    for i in np.flatnonzero(outside).tolist():
+        out[i] = fmt_time(t[i])
+    return out
+
 def visualization_layout(graph_ready):
     """Create visualization graph component"""
     return dcc.Graph(
@@ -27,6 +92,13 @@ def service_details_layout():
     """Placeholder for service details"""
     return html.Div("...", style={"padding": "20px"})
 
+def column_width_styles(widths):
+    '''style_cell_conditional pinning each column id to its width in px.'''
+    return [
+        {"if": {"column_id": col}, "minWidth": f"{px}px", "width": f"{px}px", "maxWidth": f"{px}px"}
+        for col, px in widths.items()
+    ]
+
 def make_summary_card(title, items, footer=None):
     '''Reusable helper to build a clean, minimal summary card.'''
     return dbc.Card(
@@ -76,7 +148,7 @@ def make_summary_card(title, items, footer=None):
 
 def build_service_row(svc, draw_connector):
     """Build a service row HTML component (moved from simulator.py)"""
-    svc_id_str = ','.join(str(sid) for sid in svc.serviceId) if svc.serviceId else '?'
+    svc_id_str = svc.serviceIdStr or '?'
 
     row = html.Div(
         [
@@ -89,9 +161,7 @@ def build_service_row(svc, draw_connector):
                 style={"marginLeft": "6px"}
             ),
             html.Span(
-                fmt_time(
-                    next((e.atTime for e in svc.events if e.atTime is not None), None)
-                ),
+                fmt_time(svc.firstEventTime),
                 style={"marginLeft": "6px", "color": "#64748b"}
             ),
         ],
@@ -118,7 +188,7 @@ class UIComponents:
         )
 
     @staticmethod
-    def create_time_slider(component_id, value=[165, 1605]):
+    def create_time_slider(component_id, value=(165, 1605)):
         """Factory for time range sliders"""
         return dcc.RangeSlider(
             id=component_id,
@@ -126,11 +196,11 @@ class UIComponents:
             max=1440,
             step=15,
             value=value,
-            marks={
-                i: f"{(i // 60):02d}:{(i % 60):02d}" for i in range(0, 1441, 120)
-            },
+            marks=_TIME_MARKS,
             tooltip={"placement": "bottom", "always_visible": False},
             allowCross=False,
+            # only report the value once the handle is released
+            updatemode="mouseup",
         )
 
     @staticmethod
@@ -153,12 +223,19 @@ class SimulatorUI:
     def __init__(self):
         pass
 
+    @functools.cached_property
+    def layout(self):
+        """The app layout, built on first access and reused afterwards."""
+        return self.drawLayout()
+
     def drawLayout(self):
             return html.Div(
                 [
                     # Hidden store (optional)
                     dcc.Store(id="rl-table-store"),
-                    dcc.Store(id="app-state"),
+                    dcc.Store(id="app-state", data={}),
+                    dcc.Store(id="active-tab-store", data="tab-rakelink"),
+                    dcc.Store(id="station-options", data=[]),
 
                     # === LEFT SIDEBAR ===
                     html.Div(
@@ -193,31 +270,11 @@ class SimulatorUI:
                                     dcc.Upload(
                                         id="upload-wtt-inline",
                                         children=html.Div([
-                                            html.Img(
-                                                src="/assets/excel-icon.png",
-                                                style={
-                                                    "width": "28px",
-                                                    "height": "28px",
-                                                    "marginBottom": "6px"
-                                                }
-                                            ),
-                                            html.Div("Full WTT",
-                                                    style={"fontWeight": "500", "color": "#334155", "fontSize": "14px"}),
-                                            html.Div("Click to upload",
-                                                    style={"fontSize": "11px", "color": "#94a3b8", "marginTop": "4px"})
+                                            html.Img(src="/assets/excel-icon.png", style=UPLOAD_ICON_STYLE),
+                                            html.Div("Full WTT", style=UPLOAD_TITLE_STYLE),
+                                            html.Div("Click to upload", style=UPLOAD_HINT_STYLE)
                                         ], className="text-center"),
-                                        style={
-                                            "height": "140px",
-                                            "borderWidth": "2px",
-                                            "borderStyle": "dashed",
-                                            "borderRadius": "12px",
-                                            "borderColor": "#cbd5e1",
-                                            "display": "flex",
-                                            "alignItems": "center",
-                                            "justifyContent": "center",
-                                            "cursor": "pointer",
-                                            "transition": "all 0.2s ease",
-                                        },
+                                        style=UPLOAD_STYLE,
                                         multiple=False
                                     )
                                 ], xs=12, md=6, className="mb-3 mb-md-0"),
@@ -227,31 +284,11 @@ class SimulatorUI:
                                     dcc.Upload(
                                         id="upload-summary-inline",
                                         children=html.Div([
-                                            html.Img(
-                                                src="/assets/excel-icon.png",
-                                                style={
-                                                    "width": "28px",
-                                                    "height": "28px",
-                                                    "marginBottom": "6px"
-                                                }
-                                            ),
-                                            html.Div("Rake-Link Summary",
-                                                    style={"fontWeight": "500", "color": "#334155", "fontSize": "14px"}),
-                                            html.Div("Click to upload",
-                                                    style={"fontSize": "11px", "color": "#94a3b8", "marginTop": "4px"})
+                                            html.Img(src="/assets/excel-icon.png", style=UPLOAD_ICON_STYLE),
+                                            html.Div("Rake-Link Summary", style=UPLOAD_TITLE_STYLE),
+                                            html.Div("Click to upload", style=UPLOAD_HINT_STYLE)
                                         ], className="text-center"),
-                                        style={
-                                            "height": "140px",
-                                            "borderWidth": "2px",
-                                            "borderStyle": "dashed",
-                                            "borderRadius": "12px",
-                                            "borderColor": "#cbd5e1",
-                                            "display": "flex",
-                                            "alignItems": "center",
-                                            "justifyContent": "center",
-                                            "cursor": "pointer",
-                                            "transition": "all 0.2s ease",
-                                        },
+                                        style=UPLOAD_STYLE,
                                         multiple=False
                                     )
                                 ], xs=12, md=6)
@@ -329,22 +366,11 @@ class SimulatorUI:
                                                             className="mb-3",
                                                         ),
                                                         html.Label("In time period", className="criteria-label"),
-                                                        dcc.RangeSlider(
-                                                            id="time-range-slider", # Original ID
-                                                            min=0,
-                                                            max=1440,
-                                                            step=15,
-                                                            value=[165, 1605],
-                                                            marks={
-                                                                i: f"{(i // 60):02d}:{(i % 60):02d}" for i in range(0, 1441, 120)
-                                                            },
-                                                            tooltip={"placement": "bottom", "always_visible": False},
-                                                            allowCross=False,
-                                                        ),
+                                                        UIComponents.create_time_slider("time-range-slider"),
                                                     ])
                                                 ],
                                                 className="criteria-card mb-4",
-                                                style={"margin": "0px 0px"}
+                                                style=CRITERIA_CARD_STYLE
                                             )
                                         ),
 
@@ -401,18 +427,7 @@ class SimulatorUI:
                                                             ], className="d-flex align-items-center gap-2 mb-3", style={"width": "100%"}),
                                                         ]),
                                                         html.Label("In time period", className="criteria-label"),
-                                                        dcc.RangeSlider(
-                                                            id="time-range-slider_service", # New ID
-                                                            min=0,
-                                                            max=1440,
-                                                            step=15,
-                                                            value=[165, 1605],
-                                                            marks={
-                                                                i: f"{(i // 60):02d}:{(i % 60):02d}" for i in range(0, 1441, 120)
-                                                            },
-                                                            tooltip={"placement": "bottom", "always_visible": False},
-                                                            allowCross=False,
-                                                        ),
+                                                        UIComponents.create_time_slider("time-range-slider_service"),
 
 
                                                         # html.Label("Service Type", className="criteria-label", style={"marginTop": "16px"}),
@@ -431,7 +446,7 @@ class SimulatorUI:
                                                     ])
                                                 ],
                                                 className="criteria-card mb-4",
-                                                style={"margin": "0px 0px"}
+                                                style=CRITERIA_CARD_STYLE
                                             )
                                         ),
 
@@ -440,18 +455,7 @@ class SimulatorUI:
                                                 children=dbc.Card(
                                                     [dbc.CardBody([
                                                         html.Label("In time period", className="criteria-label"),
-                                                        dcc.RangeSlider(
-                                                            id="time-range-slider_station", # New ID
-                                                            min=0,
-                                                            max=1440,
-                                                            step=15,
-                                                            value=[165, 1605],
-                                                            marks={
-                                                                i: f"{(i // 60):02d}:{(i % 60):02d}" for i in range(0, 1441, 120)
-                                                            },
-                                                            tooltip={"placement": "bottom", "always_visible": False},
-                                                            allowCross=False,
-                                                        ),
+                                                        UIComponents.create_time_slider("time-range-slider_station"),
                                                     ])]
                                                 ))
                                     ],
@@ -542,7 +546,7 @@ class SimulatorUI:
                                             # html.Hr(style={"margin": "20px 0 10px 0"}),
                                             html.Div(
                                                 id="rake-link-count",
-                                                style={"marginBottom": "6px", "fontWeight": "500"}
+                                                style=TABLE_COUNT_STYLE
                                             ),
 
                                             dash_table.DataTable(
@@ -559,11 +563,15 @@ class SimulatorUI:
                                                 data=[],
                                                 row_selectable="multi",
                                                 selected_rows=[],
-                                                page_size=45,
+                                                # only rows in the scroll viewport are in the DOM
+                                                virtualization=True,
+                                                fixed_rows={"headers": True},
+                                                page_action="none",
                                                 sort_action="native",
                                                 filter_action="native",
-                                                style_table={"maxHeight": "260px", "overflowY": "auto"},
-                                                style_cell={"padding": "6px", "fontSize": "13px"},
+                                                style_table=TABLE_STYLE,
+                                                style_cell=TABLE_CELL_STYLE,
+                                                style_cell_conditional=column_width_styles(RAKE_TABLE_WIDTHS),
                                             )
                                         ],
                                         style={"padding": "10px 0px"}
@@ -576,7 +584,7 @@ html.Div(
         html.Hr(),
         html.Div(
             id="service-count",
-            style={"marginBottom": "6px", "fontWeight": "500"}
+            style=TABLE_COUNT_STYLE
         ),
         dash_table.DataTable(
             id="service-table",
@@ -593,11 +601,14 @@ html.Div(
             data=[],
             row_selectable="multi",
             selected_rows=[],
-            page_size=45,
+            virtualization=True,
+            fixed_rows={"headers": True},
+            page_action="none",
             sort_action="native",
             filter_action="native",
-            style_table={"maxHeight": "260px", "overflowY": "auto"},
-            style_cell={"padding": "6px", "fontSize": "13px"},
+            style_table=TABLE_STYLE,
+            style_cell=TABLE_CELL_STYLE,
+            style_cell_conditional=column_width_styles(SERVICE_TABLE_WIDTHS),
         )
     ],
     style={"padding": "10px 0px", "display": "none"}  # Hidden by default
@@ -1,5 +1,7 @@
 # utils.py — AC/NAC mixing analysis helpers
 
+import numpy as np
+
 from timetable import TimeTableParser
 
 # event + sequence helpers
@@ -26,11 +28,15 @@ def getCorridorStations(start, end, distanceMap):
 def getStationEvents(station, t_lower, t_upper):
     '''
     Return station events in [t_lower, t_upper], sorted by atTime.
+    Binary search over the station's sorted index.
     '''
-    events = TimeTableParser.eventsByStationMap.get(station, [])
-    evs = [e for e in events if e.atTime is not None and t_lower <= e.atTime <= t_upper]
-    evs.sort(key=lambda e: e.atTime)
-    return evs
+    entry = TimeTableParser.stationEventIndex.get(station)
+    if entry is None:
+        return []
+    times, events = entry
+    lo = np.searchsorted(times, t_lower, side='left')
+    hi = np.searchsorted(times, t_upper, side='right')
+    return events[lo:hi]
 
 
 def getStationSequence(events):